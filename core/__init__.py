@@ -0,0 +1 @@
+# Empty file to make the directory a package
\ No newline at end of file
@@ -0,0 +1,43 @@
+from array import array
+import time
+
+# Timestamped boot phases. ticks_us() counts from reset on the board, so
+# each mark is the time from reset to the end of that phase.
+MAX_PHASES = 16
+
+_names = [None] * MAX_PHASES
+_ticks = array('L', [0] * MAX_PHASES)
+_count = 0
+
+def mark(name):
+    """Record that boot phase `name` has just finished"""
+    global _count
+    if _count < MAX_PHASES:
+        _names[_count] = name
+        _ticks[_count] = time.ticks_us()
+        _count += 1
+
+def elapsed_us(name):
+    """Microseconds from reset to the mark called `name`, or None"""
+    for index in range(_count):
+        if _names[index] == name:
+            return _ticks[index]
+    return None
+
+def phases():
+    """[(name, us_since_reset, us_since_previous_mark), ...]"""
+    result = []
+    previous = 0
+    for index in range(_count):
+        result.append((_names[index], _ticks[index], time.ticks_diff(_ticks[index], previous)))
+        previous = _ticks[index]
+    return result
+
+def report():
+    print("boot phase        since reset      step")
+    for name, since_reset, step in phases():
+        print("%-16s %9d us %9d us" % (name, since_reset, step))
+
+def reset():
+    global _count
+    _count = 0
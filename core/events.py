@@ -0,0 +1,130 @@
+from array import array
+import asyncio
+import time
+
+# Event types are small ints. The built-in input events come first;
+# applications number their own from USER up to MAX_TYPES - 1.
+ROTATE = 1   # value: signed knob steps (accelerated if there is an accelerator)
+GESTURE = 2  # value: a devices.gestures code
+USER = 8
+MAX_TYPES = 32
+
+RING_SIZE = 32
+
+class EventBus:
+    def __init__(self, size=RING_SIZE, types=MAX_TYPES):
+        """
+        (type, value) events in a ring of preallocated slots, handed to
+        the subscribers of their type by dispatch(). Posting and
+        dispatching never allocate. A type marked with coalesce() is
+        added into the newest pending event when that has the same type,
+        so a burst reaches subscribers as one event with the summed value.
+        post() is for tasks and soft callbacks, not hard IRQs.
+        """
+        self._types = bytearray(size)
+        self._values = array('l', [0] * size)
+        self._ticks = array('L', [0] * size)
+        self._size = size
+        self._head = 0
+        self._tail = 0
+        self._handlers = [None] * types
+        self._coalesce = bytearray(types)
+        self._wake = asyncio.ThreadSafeFlag()
+        self.event_us = 0  # ticks_us of the first post of the event being dispatched
+        # Statistics
+        self.posted = 0
+        self.merged = 0
+        self.dropped = 0
+        self.dispatched = 0
+
+    def subscribe(self, event_type, handler):
+        """Call handler(value) for every event of event_type, in subscription order"""
+        handlers = self._handlers[event_type]
+        if handlers is None:
+            handlers = self._handlers[event_type] = []
+        handlers.append(handler)
+
+    def coalesce(self, event_type):
+        """Sum back-to-back events of this type into one"""
+        self._coalesce[event_type] = 1
+
+    def post(self, event_type, value=0):
+        """Queue an event; False if the ring was full and it was dropped"""
+        head = self._head
+        if self._coalesce[event_type] and head != self._tail:
+            newest = (head - 1) % self._size
+            if self._types[newest] == event_type:
+                self._values[newest] += value
+                self.merged += 1
+                return True
+        next_head = (head + 1) % self._size
+        if next_head == self._tail:
+            self.dropped += 1
+            return False
+        self._types[head] = event_type
+        self._values[head] = value
+        self._ticks[head] = time.ticks_us()
+        self._head = next_head
+        self.posted += 1
+        self._wake.set()
+        return True
+
+    def pending(self):
+        return (self._head - self._tail) % self._size
+
+    def dispatch(self):
+        """
+        Hand every pending event to its subscribers, oldest first,
+        including ones the handlers post on the way. Returns how many.
+        """
+        count = 0
+        while self._tail != self._head:
+            tail = self._tail
+            event_type = self._types[tail]
+            value = self._values[tail]
+            self.event_us = self._ticks[tail]
+            # Free the slot first so a handler's post() can't merge into it
+            self._tail = (tail + 1) % self._size
+            handlers = self._handlers[event_type]
+            if handlers is not None:
+                for index in range(len(handlers)):
+                    handlers[index](value)
+            count += 1
+        self.dispatched += count
+        return count
+
+    async def wait(self):
+        """Sleep until something has been posted"""
+        await self._wake.wait()
+
+    async def run(self):
+        """Background task: dispatch whenever something has been posted"""
+        while True:
+            await self._wake.wait()
+            self.dispatch()
+
+async def pump_encoder(bus, encoder, accel=None):
+    """
+    Task feeding an EncoderDriver into a bus: ROTATE with the steps since
+    the last pass (through a devices.acceleration.EncoderAccelerator if
+    given, raw counts otherwise), then a GESTURE per button gesture.
+    Mark ROTATE with bus.coalesce() to fold bursts the dispatcher falls
+    behind on into one event.
+    """
+    last_count = encoder.get_counter()
+    while True:
+        if accel is not None:
+            await accel.wait()
+            steps = accel.read()
+        else:
+            await encoder.wait()
+            count = encoder.get_counter()
+            steps = count - last_count
+            last_count = count
+        if steps:
+            bus.post(ROTATE, steps)
+        while True:
+            event = encoder.get_gesture()
+            if not event:
+                break
+            bus.post(GESTURE, event)
@@ -0,0 +1,122 @@
+import machine
+import time
+
+class IdleManager:
+    def __init__(self, scheduler, settle_ms=500, idle_ms=30000, lightsleep=False,
+                 min_sleep_ms=50):
+        """
+        Cut power while nothing is happening. Servo displays added with
+        add_display() are detached once settle_ms have passed since their
+        last commit(). idle_ms after the last input() the board counts as
+        idle, and with lightsleep=True the scheduler light-sleeps through
+        gaps of at least min_sleep_ms between jobs. Call input() from the
+        input handlers to wake everything up.
+
+        The manager's job only runs at those deadlines and parks once
+        nothing is pending, so an idle board wakes for its other jobs and
+        IRQs alone; a commit() or input() arms it again.
+
+        Light sleep stops PWM outputs on some ports (RP2 among them), so
+        only enable it when nothing has to keep running; keep_awake()
+        checks veto it.
+        """
+        self.scheduler = scheduler
+        self.settle_ms = settle_ms
+        self.idle_ms = idle_ms
+        self.lightsleep = lightsleep
+        self.min_sleep_ms = min_sleep_ms
+        self.idle = False
+        self._displays = []
+        self._busy = []
+        self._last_input = time.ticks_ms()
+        # Statistics
+        self.detaches = 0
+        self.sleeps = 0
+        self.slept_ms = 0
+        self.job = scheduler.add(self.tick, settle_ms, -1, 'idle', delay_ms=min(settle_ms, idle_ms))
+        scheduler.idle = self
+
+    def add_display(self, display):
+        """Detach display's servos once they have settled"""
+        # [display, writes seen, ticks_ms of the last commit, attached]
+        entry = [display, display.writes, time.ticks_ms(), True]
+        self._displays.append(entry)
+
+        def committed():
+            entry[1] = display.writes
+            entry[2] = time.ticks_ms()
+            entry[3] = True
+            self._arm(self.settle_ms)
+
+        display.on_commit = committed
+        self._arm(self.settle_ms)
+
+    def keep_awake(self, check):
+        """check() returning True prevents light sleep (e.g. a sound playing)"""
+        self._busy.append(check)
+
+    def input(self):
+        """Note user input; leaves idle mode straight away"""
+        self._last_input = time.ticks_ms()
+        self.idle = False
+        self._arm(self.idle_ms)
+
+    def _arm(self, delay_ms):
+        """Make sure the job runs within delay_ms; safe from an IRQ"""
+        job = self.job
+        now = time.ticks_ms()
+        if not job.enabled or time.ticks_diff(time.ticks_add(now, delay_ms), job.due) < 0:
+            job.run_in(delay_ms, now)
+
+    def tick(self, now):
+        wait = -1
+        for entry in self._displays:
+            display = entry[0]
+            writes = display.writes
+            if writes != entry[1]:
+                # Written without a commit(); settle from now
+                entry[1] = writes
+                entry[2] = now
+                entry[3] = True
+            if not entry[3]:
+                continue
+            left = self.settle_ms - time.ticks_diff(now, entry[2])
+            if left <= 0:
+                display.detach()
+                entry[1] = display.writes
+                entry[3] = False
+                self.detaches += 1
+            elif wait < 0 or left < wait:
+                wait = left
+        if not self.idle:
+            left = self.idle_ms - time.ticks_diff(now, self._last_input)
+            if left <= 0:
+                self.idle = True
+            elif wait < 0 or left < wait:
+                wait = left
+        if wait < 0:
+            return False  # Parked until the next commit() or input()
+        self.job.run_in(wait, now)
+
+    def sleep(self, delay_ms):
+        """
+        Called by Scheduler.run() before it waits delay_ms for the next job.
+        Light-sleeps instead and returns True when that is allowed.
+        """
+        if not (self.lightsleep and self.idle) or delay_ms < self.min_sleep_ms:
+            return False
+        for check in self._busy:
+            if check():
+                return False
+        for entry in self._displays:
+            if entry[3]:
+                return False
+        started = time.ticks_ms()
+        machine.lightsleep(delay_ms)
+        self.sleeps += 1
+        self.slept_ms += time.ticks_diff(time.ticks_ms(), started)
+        return True
+
+    def report(self):
+        print("idle %s  detaches %d  sleeps %d  slept %d ms" % (
+            self.idle, self.detaches, self.sleeps, self.slept_ms))
@@ -0,0 +1,156 @@
+from array import array
+import time
+
+# Opt-in hot-path instrumentation. Call enable() before creating the objects
+# to be measured; until then histogram()/counter() hand out a shared no-op
+# object, so instrumented code pays one empty method call.
+enabled = False
+
+LATENCY_BUCKETS_US = (100, 250, 500, 1000, 2500, 5000, 10000, 50000)
+LATENESS_BUCKETS_MS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+_metrics = []
+_probes = []
+
+class Histogram:
+    def __init__(self, name, bounds):
+        """Fixed buckets: counts[i] holds values <= bounds[i], the last one the rest"""
+        self.name = name
+        self.bounds = array('L', bounds)
+        self.counts = array('L', [0] * (len(bounds) + 1))
+        self.total = 0
+        self.max = 0
+
+    def record(self, value):
+        bounds = self.bounds
+        index = 0
+        while index < len(bounds) and value > bounds[index]:
+            index += 1
+        self.counts[index] += 1
+        self.total += 1
+        if value > self.max:
+            self.max = value
+
+    def start(self):
+        return time.ticks_us()
+
+    def stop(self, started):
+        """Record the microseconds since start() (or any ticks_us value)"""
+        self.record(time.ticks_diff(time.ticks_us(), started))
+
+    def percentile(self, pct):
+        """Upper bound of the bucket holding the pct-th percentile"""
+        if not self.total:
+            return 0
+        wanted = (self.total * pct + 99) // 100
+        seen = 0
+        for index in range(len(self.counts)):
+            seen += self.counts[index]
+            if seen >= wanted:
+                return self.bounds[index] if index < len(self.bounds) else self.max
+        return self.max
+
+    def reset(self):
+        for index in range(len(self.counts)):
+            self.counts[index] = 0
+        self.total = 0
+        self.max = 0
+
+    def summary(self):
+        return "%s n=%d p50<=%d p99<=%d max=%d [%s]" % (
+            self.name, self.total, self.percentile(50), self.percentile(99), self.max,
+            ' '.join(str(count) for count in self.counts))
+
+class Counter:
+    def __init__(self, name):
+        self.name = name
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def reset(self):
+        self.value = 0
+
+    def summary(self):
+        return "%s %d" % (self.name, self.value)
+
+class _Null:
+    """Stands in for every metric while metrics are disabled"""
+    name = None
+    value = 0
+    total = 0
+
+    def record(self, value):
+        pass
+
+    def start(self):
+        return 0
+
+    def stop(self, started):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+_NULL = _Null()
+
+def enable():
+    global enabled
+    enabled = True
+
+def histogram(name, bounds=LATENCY_BUCKETS_US):
+    if not enabled:
+        return _NULL
+    metric = Histogram(name, bounds)
+    _metrics.append(metric)
+    return metric
+
+def counter(name):
+    if not enabled:
+        return _NULL
+    metric = Counter(name)
+    _metrics.append(metric)
+    return metric
+
+def probe(name, read):
+    """
+    Report read() at dump time. For counters the code already keeps as
+    plain ints (IRQ counts, PWM writes), which then cost nothing extra.
+    """
+    if enabled:
+        _probes.append((name, read))
+
+def dump():
+    """Print one compact line per metric over the REPL/serial console"""
+    if not enabled:
+        print("metrics disabled")
+        return
+    for metric in _metrics:
+        print(metric.summary())
+    for name, read in _probes:
+        print("%s %d" % (name, read()))
+
+def values():
+    """
+    [(name, int)] for every metric and probe: counters as they are,
+    histograms as name.n, name.p50, name.p99 and name.max
+    """
+    result = []
+    if not enabled:
+        return result
+    for metric in _metrics:
+        if isinstance(metric, Histogram):
+            result.append((metric.name + '.n', metric.total))
+            result.append((metric.name + '.p50', metric.percentile(50)))
+            result.append((metric.name + '.p99', metric.percentile(99)))
+            result.append((metric.name + '.max', metric.max))
+        else:
+            result.append((metric.name, metric.value))
+    for name, read in _probes:
+        result.append((name, read()))
+    return result
+
+def reset():
+    for metric in _metrics:
+        metric.reset()
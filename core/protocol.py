@@ -0,0 +1,250 @@
+from array import array
+import asyncio
+from . import metrics
+from .storage import crc16
+
+# Binary command frames, for calibration rigs and scripted tests:
+#
+#   0xA5 0x5A  command  sequence  length (u16)  payload  CRC-16 (u16)
+#
+# Multi-byte fields are little-endian; the CRC (core.storage.crc16) covers
+# command through payload. Every frame is answered with the same layout,
+# command | REPLY, the same sequence number and a payload that starts with
+# a status byte, unless the command had QUIET set and succeeded, so a host
+# can stream frames without waiting for each answer.
+SYNC = b'\xa5\x5a'
+HEADER_SIZE = 6
+CRC_SIZE = 2
+MAX_PAYLOAD = 512
+
+REPLY = 0x80
+QUIET = 0x40
+
+# Commands (below QUIET)
+PING = 0x01
+SERVO_FRAME = 0x10  # u8 first channel, then a u16 pulse width (us) per channel
+CALIBRATE = 0x11    # u8 servo, u8 digit, u16 pulse width (us): ClockFace table entry
+COLOR = 0x20        # u16 red, green, blue
+PALETTE = 0x21      # u16 segment_ms, then u16 red, green, blue per colour; cycles them
+MELODY = 0x28       # u8 priority, then u16 frequency, u16 duration_ms per note
+METRICS = 0x30      # Reply: (u8 name length, name, i32 value) per core.metrics value
+SAVE = 0x38         # Write the persistent state now
+LOAD = 0x39         # Reload the persistent state
+
+# Reply status
+OK = 0
+BAD_CRC = 1
+UNKNOWN = 2
+BAD_LENGTH = 3
+UNSUPPORTED = 4  # Nothing to do it with on this device
+FAILED = 5
+
+def encode(out, command, sequence, payload=b''):
+    """Build a frame in the bytearray `out`; returns its length"""
+    length = len(payload)
+    out[0] = 0xA5
+    out[1] = 0x5A
+    out[2] = command
+    out[3] = sequence & 0xff
+    out[4] = length & 0xff
+    out[5] = length >> 8
+    out[HEADER_SIZE:HEADER_SIZE + length] = payload
+    end = HEADER_SIZE + length
+    crc = crc16(memoryview(out)[2:], end - 2)
+    out[end] = crc & 0xff
+    out[end + 1] = crc >> 8
+    return end + CRC_SIZE
+
+class CommandServer:
+    def __init__(self, reader, writer, display=None, clock=None, led_fx=None,
+                 buzzer=None, store=None, on_load=None):
+        """
+        Serve command frames from an asyncio stream pair: a UART wrapped
+        as asyncio.StreamReader(uart) / StreamWriter(uart, {}), or stdin.
+        Frames are assembled and parsed in place in preallocated buffers;
+        only PALETTE and MELODY allocate, since the animator and the
+        sequencer keep what they are given. Leave out any device the
+        board does not have; its commands then answer UNSUPPORTED.
+        store is a core.storage.PersistentState flushed by SAVE, and
+        on_load() reloads the state, returning False on failure.
+        """
+        self.reader = reader
+        self.writer = writer
+        self.display = display
+        self.clock = clock
+        self.led_fx = led_fx
+        self.buzzer = buzzer
+        self.store = store
+        self.on_load = on_load
+        self.frame = bytearray(HEADER_SIZE + MAX_PAYLOAD + CRC_SIZE)
+        self._body = memoryview(self.frame)[2:]
+        self.reply = bytearray(HEADER_SIZE + MAX_PAYLOAD + CRC_SIZE)
+        self._reply_view = memoryview(self.reply)
+        self._reply_body = self._reply_view[2:]
+        self._rx = bytearray(64)
+        self._color = array('H', [0, 0, 0])
+        self._pos = 0
+        self._need = 0
+        self._replied = False
+        # Statistics
+        self.frames = 0
+        self.errors = 0  # Bad CRC, oversize or malformed frames
+
+    async def run(self):
+        rx = self._rx
+        while True:
+            count = await self.reader.readinto(rx)
+            if not count:
+                await asyncio.sleep_ms(10)
+                continue
+            self.feed(rx, count)
+            if self._replied:
+                self._replied = False
+                await self.writer.drain()
+
+    def feed(self, data, count):
+        """Run count bytes of data through the frame assembler"""
+        frame = self.frame
+        pos = self._pos
+        for index in range(count):
+            byte = data[index]
+            if pos == 0:
+                if byte == 0xA5:
+                    pos = 1
+            elif pos == 1:
+                pos = 2 if byte == 0x5A else (1 if byte == 0xA5 else 0)
+            else:
+                frame[pos] = byte
+                pos += 1
+                if pos == HEADER_SIZE:
+                    length = frame[4] | (frame[5] << 8)
+                    if length > MAX_PAYLOAD:
+                        self.errors += 1
+                        pos = 0
+                    else:
+                        self._need = HEADER_SIZE + length + CRC_SIZE
+                elif pos > HEADER_SIZE and pos == self._need:
+                    self._complete()
+                    pos = 0
+        self._pos = pos
+
+    def _complete(self):
+        frame = self.frame
+        end = self._need - CRC_SIZE
+        command = frame[2]
+        if crc16(self._body, end - 2) != frame[end] | (frame[end + 1] << 8):
+            self.errors += 1
+            self._answer(command, BAD_CRC)
+            return
+        self.frames += 1
+        length = end - HEADER_SIZE
+        status = self._execute(command & ~QUIET, length)
+        if status < 0:
+            return  # Already answered with data
+        if status != OK or not command & QUIET:
+            self._answer(command, status)
+
+    def _answer(self, command, status, length=0):
+        """Send a reply whose data (if any) is already in reply[HEADER_SIZE + 1:]"""
+        reply = self.reply
+        reply[0] = 0xA5
+        reply[1] = 0x5A
+        reply[2] = (command & ~QUIET) | REPLY
+        reply[3] = self.frame[3]
+        reply[4] = (length + 1) & 0xff
+        reply[5] = (length + 1) >> 8
+        reply[HEADER_SIZE] = status
+        end = HEADER_SIZE + 1 + length
+        crc = crc16(self._reply_body, end - 2)
+        reply[end] = crc & 0xff
+        reply[end + 1] = crc >> 8
+        self.writer.write(self._reply_view[:end + CRC_SIZE])
+        self._replied = True
+
+    def _u16(self, offset):
+        frame = self.frame
+        return frame[HEADER_SIZE + offset] | (frame[HEADER_SIZE + offset + 1] << 8)
+
+    def _execute(self, command, length):
+        frame = self.frame
+        if command == PING:
+            return OK
+        if command == SERVO_FRAME:
+            display = self.display
+            if display is None:
+                return UNSUPPORTED
+            count = (length - 1) // 2
+            first = frame[HEADER_SIZE]
+            if not length & 1 or first + count > display.channels:
+                return BAD_LENGTH
+            if self.clock is not None:
+                # The clock would draw over the frame on its next tick
+                self.clock.pause()
+            for index in range(count):
+                display.stage_us(first + index, self._u16(1 + 2 * index))
+            display.commit()
+            return OK
+        if command == CALIBRATE:
+            if self.clock is None:
+                return UNSUPPORTED
+            if length != 4 or frame[HEADER_SIZE] >= len(self.clock.shown) or frame[HEADER_SIZE + 1] > 9:
+                return BAD_LENGTH
+            self.clock.calibrate(frame[HEADER_SIZE], frame[HEADER_SIZE + 1], self._u16(2))
+            return OK
+        if command == COLOR:
+            if self.led_fx is None:
+                return UNSUPPORTED
+            if length != 6:
+                return BAD_LENGTH
+            color = self._color
+            for channel in range(3):
+                color[channel] = self._u16(2 * channel)
+            self.led_fx.set(color)
+            return OK
+        if command == PALETTE:
+            if self.led_fx is None:
+                return UNSUPPORTED
+            if length < 8 or (length - 2) % 6:
+                return BAD_LENGTH
+            palette = tuple((self._u16(offset), self._u16(offset + 2), self._u16(offset + 4))
+                            for offset in range(2, length, 6))
+            self.led_fx.cycle(palette, self._u16(0))
+            return OK
+        if command == MELODY:
+            if self.buzzer is None:
+                return UNSUPPORTED
+            if length < 5 or (length - 1) % 4:
+                return BAD_LENGTH
+            melody = array('H', [self._u16(offset) for offset in range(1, length, 2)])
+            self.buzzer.play(melody, frame[HEADER_SIZE])
+            return OK
+        if command == METRICS:
+            return self._metrics()
+        if command == SAVE:
+            if self.store is None:
+                return UNSUPPORTED
+            self.store.touch()
+            self.store.flush()
+            return FAILED if self.store.dirty else OK
+        if command == LOAD:
+            if self.on_load is None:
+                return UNSUPPORTED
+            return OK if self.on_load() else FAILED
+        return UNKNOWN
+
+    def _metrics(self):
+        reply = self.reply
+        pos = HEADER_SIZE + 1
+        limit = HEADER_SIZE + MAX_PAYLOAD
+        for name, value in metrics.values():
+            size = len(name)
+            if pos + 1 + size + 4 > limit:
+                break
+            reply[pos] = size
+            reply[pos + 1:pos + 1 + size] = name.encode()
+            pos += 1 + size
+            for shift in (0, 8, 16, 24):
+                reply[pos] = (value >> shift) & 0xff
+                pos += 1
+        self._answer(METRICS, OK, pos - HEADER_SIZE - 1)
+        return -1
@@ -0,0 +1,138 @@
+import asyncio
+import time
+from . import metrics
+
+class Job:
+    def __init__(self, scheduler, func, period_ms, priority, name, budget_us, due):
+        self.scheduler = scheduler
+        self.func = func
+        self.period_ms = period_ms
+        self.priority = priority
+        self.name = name
+        self.budget_us = budget_us
+        self.due = due
+        self.enabled = True
+        self._moved = False  # run_in() was called since the last run started
+        # Statistics
+        self.runs = 0
+        self.overruns = 0     # Runs that took longer than budget_us
+        self.missed = 0       # Periods skipped because the job started late
+        self.max_us = 0       # Longest run
+        self.max_late_ms = 0  # Worst start delay past the due time
+
+    def resume(self, delay_ms=0):
+        """Re-enable a parked job, first run after delay_ms"""
+        if not self.enabled:
+            self.enabled = True
+            self.due = time.ticks_add(time.ticks_ms(), delay_ms)
+            self.scheduler.wake()
+
+    def run_in(self, delay_ms, now=None):
+        """
+        Make the next run due delay_ms after ticks_ms `now` (default: now),
+        parked or not. Called from the job itself, it replaces this run's
+        step by period_ms. Safe from an IRQ.
+        """
+        if now is None:
+            now = time.ticks_ms()
+        self.due = time.ticks_add(now, delay_ms)
+        self.enabled = True
+        self._moved = True
+        self.scheduler.wake()
+
+    def pause(self):
+        self.enabled = False
+
+class Scheduler:
+    def __init__(self):
+        """
+        Runs periodic jobs from a single task. Jobs are plain callables
+        taking the current ticks_ms; returning False parks the job until
+        job.resume(). When several jobs are due, higher priority runs first.
+        """
+        self.jobs = []
+        self._wake = asyncio.ThreadSafeFlag()
+        self.idle = None  # core.idle.IdleManager, which may light-sleep in run()
+        self.lateness = metrics.histogram('scheduler.late_ms', metrics.LATENESS_BUCKETS_MS)
+
+    def add(self, func, period_ms, priority=0, name=None, budget_us=None, delay_ms=0):
+        """Register func to run every period_ms, the first time after delay_ms"""
+        if budget_us is None:
+            budget_us = period_ms * 1000 // 4
+        job = Job(self, func, period_ms, priority, name or getattr(func, '__name__', 'job'),
+                  budget_us, time.ticks_add(time.ticks_ms(), delay_ms))
+        jobs = self.jobs
+        index = 0
+        while index < len(jobs) and jobs[index].priority >= priority:
+            index += 1
+        jobs.insert(index, job)
+        self.wake()
+        return job
+
+    def remove(self, job):
+        self.jobs.remove(job)
+
+    def wake(self):
+        """Make run() re-check its jobs now; safe from an IRQ"""
+        self._wake.set()
+
+    def run_due(self, now):
+        """Run every job that is due; returns ms until the next one, or None"""
+        next_ms = None
+        for job in self.jobs:
+            if not job.enabled:
+                continue
+            late = time.ticks_diff(now, job.due)
+            if late >= 0:
+                started = time.ticks_us()
+                job._moved = False
+                keep = job.func(now)
+                took = time.ticks_diff(time.ticks_us(), started)
+                job.runs += 1
+                if took > job.max_us:
+                    job.max_us = took
+                if took > job.budget_us:
+                    job.overruns += 1
+                if late > job.max_late_ms:
+                    job.max_late_ms = late
+                self.lateness.record(late)
+                if keep is False:
+                    job.enabled = False
+                    continue
+                if not job._moved:  # Otherwise the job picked its next due time
+                    if late >= job.period_ms:
+                        # Too far behind: skip the missed periods, keep the phase
+                        skipped = late // job.period_ms
+                        job.missed += skipped
+                        job.due = time.ticks_add(job.due, skipped * job.period_ms)
+                    job.due = time.ticks_add(job.due, job.period_ms)
+            wait = max(0, time.ticks_diff(job.due, now))
+            if next_ms is None or wait < next_ms:
+                next_ms = wait
+        return next_ms
+
+    async def run(self):
+        while True:
+            delay = self.run_due(time.ticks_ms())
+            if delay is None:
+                await self._wake.wait()
+                continue
+            if delay:
+                if self.idle is not None and self.idle.sleep(delay):
+                    # Let whatever the wake-up IRQ scheduled run first
+                    await asyncio.sleep_ms(0)
+                    continue
+                try:
+                    await asyncio.wait_for_ms(self._wake.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep_ms(0)
+
+    def report(self):
+        """Print one line of timing statistics per job"""
+        print("job              period  prio   runs  over  missed  max_us  max_late")
+        for job in self.jobs:
+            print("%-16s %6d  %4d  %5d  %4d  %6d  %6d  %8d" % (
+                job.name, job.period_ms, job.priority, job.runs, job.overruns,
+                job.missed, job.max_us, job.max_late_ms))
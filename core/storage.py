@@ -0,0 +1,151 @@
+from array import array
+import struct
+import time
+
+MAGIC = 0xA5
+_HEADER = '<BI'  # magic, sequence number
+_HEADER_SIZE = 5
+_CRC_SIZE = 2
+
+def _crc_table():
+    table = array('H', [0] * 256)
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else crc << 1
+        table[byte] = crc & 0xffff
+    return table
+
+_CRC_TABLE = _crc_table()
+
+def crc16(data, length=None, crc=0xffff):
+    """CRC-16/CCITT-FALSE over the first `length` bytes of data"""
+    table = _CRC_TABLE
+    for index in range(len(data) if length is None else length):
+        crc = ((crc << 8) & 0xffff) ^ table[(crc >> 8) ^ data[index]]
+    return crc
+
+class StateLog:
+    def __init__(self, path, payload_size, slots=16):
+        """
+        Fixed-size records appended round-robin over `slots` slots of one
+        file, so each save touches one small region and the previous
+        record survives a torn write. Each record is magic, a sequence
+        number, the payload and a CRC.
+        """
+        self.path = path
+        self.payload_size = payload_size
+        self.slots = slots
+        self.record_size = _HEADER_SIZE + payload_size + _CRC_SIZE
+        self.payload = bytearray(payload_size)  # Fill this, then save()
+        self._record = bytearray(self.record_size)
+        self._slot = slots - 1  # Slot of the newest record
+        self._sequence = 0
+        self.writes = 0
+
+    def _open(self):
+        try:
+            return open(self.path, 'r+b')
+        except OSError:
+            with open(self.path, 'wb') as f:
+                f.write(bytes(self.record_size * self.slots))
+            return open(self.path, 'r+b')
+
+    def load(self):
+        """
+        Copy the newest record with a valid CRC into self.payload and return
+        it, or None if there is none. Only headers are scanned; full records
+        are read newest first until one checks out.
+        """
+        try:
+            f = open(self.path, 'rb')
+        except OSError:
+            return None
+        with f:
+            header = bytearray(_HEADER_SIZE)
+            candidates = []
+            for slot in range(self.slots):
+                f.seek(slot * self.record_size)
+                if f.readinto(header) != _HEADER_SIZE:
+                    break
+                magic, sequence = struct.unpack(_HEADER, header)
+                if magic == MAGIC:
+                    candidates.append((sequence, slot))
+            candidates.sort(reverse=True)
+            record = self._record
+            for sequence, slot in candidates:
+                f.seek(slot * self.record_size)
+                if f.readinto(record) != self.record_size:
+                    continue
+                body = self.record_size - _CRC_SIZE
+                if crc16(record, body) != struct.unpack_from('<H', record, body)[0]:
+                    continue
+                self._slot = slot
+                self._sequence = sequence
+                self.payload[:] = record[_HEADER_SIZE:body]
+                return self.payload
+        return None
+
+    def save(self):
+        """Write self.payload as the next record"""
+        slot = (self._slot + 1) % self.slots
+        sequence = self._sequence + 1
+        record = self._record
+        body = self.record_size - _CRC_SIZE
+        struct.pack_into(_HEADER, record, 0, MAGIC, sequence)
+        record[_HEADER_SIZE:body] = self.payload
+        struct.pack_into('<H', record, body, crc16(record, body))
+        with self._open() as f:
+            f.seek(slot * self.record_size)
+            f.write(record)
+        self._slot = slot
+        self._sequence = sequence
+        self.writes += 1
+
+class PersistentState:
+    def __init__(self, log, fill, quiet_ms=2000):
+        """
+        Write-behind wrapper around a StateLog. Call touch() on every
+        change; fill(payload) is called to encode the state once nothing
+        has changed for quiet_ms, so bursts of changes cost one write.
+        """
+        self.log = log
+        self.fill = fill
+        self.quiet_ms = quiet_ms
+        self.dirty = False
+        self.errors = 0
+        self.job = None
+        self._deadline = 0
+
+    def touch(self):
+        self.dirty = True
+        self._deadline = time.ticks_add(time.ticks_ms(), self.quiet_ms)
+        if self.job:
+            self.job.resume(self.quiet_ms)
+
+    def flush(self):
+        """Write now if anything changed"""
+        if self.dirty:
+            self.fill(self.log.payload)
+            try:
+                self.log.save()
+            except OSError:
+                # Stay dirty and try again after the next quiet period
+                self.errors += 1
+                self._deadline = time.ticks_add(time.ticks_ms(), self.quiet_ms)
+                return
+            self.dirty = False
+
+    def tick(self, now=None):
+        if now is None:
+            now = time.ticks_ms()
+        if self.dirty and time.ticks_diff(now, self._deadline) >= 0:
+            self.flush()
+        return self.dirty
+
+    def schedule(self, scheduler, priority=0):
+        """Check for a quiet period from a core.scheduler.Scheduler job"""
+        self.job = scheduler.add(self.tick, max(1, self.quiet_ms // 4), priority, 'storage')
+        if not self.dirty:
+            self.job.pause()
+        return self.job
@@ -0,0 +1,115 @@
+from array import array
+import struct
+import time
+
+# Raw encoder input traces. Each record is the time since recording started
+# and the state of the three lines right after an edge, as bits
+# CLK << 2 | DT << 1 | SW. The file is a header followed by the offsets as
+# little-endian u32s and then the states as bytes, so it loads with two
+# readinto() calls.
+MAGIC = b'RTRC'
+VERSION = 1
+_HEADER = '<4sBBBBiI'  # magic, version, initial state, resolution, flags, steps, count
+_HEADER_SIZE = 16
+_REVERSED = 1
+
+CLK = 4
+DT = 2
+SW = 1
+
+class Trace:
+    def __init__(self, capacity=0):
+        """
+        Edges as parallel arrays: offsets[i] microseconds after the start,
+        states[i] the line levels after it. steps is the net rotation in
+        quarter steps (positive is the direction EncoderDriver counts up),
+        so a replay knows what any decoder setting should count.
+        """
+        self.offsets = array('I', [0] * capacity)
+        self.states = bytearray(capacity)
+        self.count = 0
+        self.initial = CLK | DT | SW
+        self.resolution = 4
+        self.reverse = False
+        self.steps = 0
+
+    def expected(self, resolution, reverse=False):
+        """Count a decoder with these settings should end on"""
+        counts = abs(self.steps) // (4 // resolution)
+        return -counts if (self.steps < 0) != reverse else counts
+
+    def duration_us(self):
+        return self.offsets[self.count - 1] if self.count else 0
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(struct.pack(_HEADER, MAGIC, VERSION, self.initial, self.resolution,
+                                _REVERSED if self.reverse else 0, self.steps, self.count))
+            f.write(memoryview(self.offsets)[:self.count])
+            f.write(memoryview(self.states)[:self.count])
+
+def load(path):
+    with open(path, 'rb') as f:
+        header = f.read(_HEADER_SIZE)
+        if len(header) != _HEADER_SIZE:
+            raise ValueError("not a trace file")
+        magic, version, initial, resolution, flags, steps, count = struct.unpack(_HEADER, header)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("not a trace file")
+        trace = Trace(count)
+        f.readinto(trace.offsets)
+        f.readinto(trace.states)
+    trace.count = count
+    trace.initial = initial
+    trace.resolution = resolution
+    trace.reverse = bool(flags & _REVERSED)
+    trace.steps = steps
+    return trace
+
+class TraceRecorder:
+    def __init__(self, encoder, capacity=2048):
+        """
+        Capture the raw CLK/DT/SW edges an EncoderDriver sees. Everything
+        is preallocated; edges past capacity are counted in dropped.
+        """
+        self.encoder = encoder
+        self.trace = Trace(capacity)
+        self.dropped = 0
+        self._start_us = 0
+        self._start_counter = 0
+        self._tap = self._edge  # Bound once so the IRQ doesn't allocate
+
+    def _state(self):
+        encoder = self.encoder
+        sw = encoder.sw.value() if encoder.sw else 1
+        return (encoder.clk.value() << 2) | (encoder.dt.value() << 1) | sw
+
+    def _edge(self):
+        """Called from the encoder IRQs"""
+        trace = self.trace
+        count = trace.count
+        if count == len(trace.states):
+            self.dropped += 1
+            return
+        trace.offsets[count] = time.ticks_diff(time.ticks_us(), self._start_us)
+        trace.states[count] = self._state()
+        trace.count = count + 1
+
+    def start(self):
+        trace = self.trace
+        trace.count = 0
+        trace.initial = self._state()
+        trace.resolution = self.encoder.decoder.resolution
+        trace.reverse = self.encoder.decoder.reverse
+        self.dropped = 0
+        self._start_counter = self.encoder.counter
+        self._start_us = time.ticks_us()
+        self.encoder.tap = self._tap
+
+    def stop(self):
+        """Stop recording and return the trace"""
+        self.encoder.tap = None
+        trace = self.trace
+        counts = self.encoder.counter - self._start_counter
+        trace.steps = (-counts if trace.reverse else counts) * (4 // trace.resolution)
+        return trace
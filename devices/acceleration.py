@@ -0,0 +1,95 @@
+from array import array
+import asyncio
+import time
+
+# Acceleration curve: (edge interval in microseconds, gain) pairs from the
+# fastest to the slowest. An edge that came within an interval of the one
+# before it counts `gain` times; anything slower than the last entry counts
+# once. At one count per detent, a lazy flick runs at 30-60 detents/s.
+DEFAULT_CURVE = ((8000, 10), (15000, 6), (30000, 3), (60000, 2))
+
+BATCH = 16  # Edges copied out of the driver's ring per read_edges() call
+
+class EncoderAccelerator:
+    def __init__(self, encoder, curve=DEFAULT_CURVE, frame_ms=0):
+        """
+        Turn an EncoderDriver's edges into accelerated steps: read()
+        returns every edge since the last call, each scaled by how soon it
+        followed the previous one, as one signed total. Reading once per
+        wake-up folds a burst of detents into a single output update.
+        With frame_ms, wait() also holds back until frame_ms after the
+        last update so fast spins are folded into frames of that length.
+        """
+        self.encoder = encoder
+        self.frame_ms = frame_ms
+        self.set_curve(curve)
+        self._ticks = array('L', [0] * BATCH)
+        self._deltas = array('b', [0] * BATCH)
+        self._last_us = time.ticks_us()
+        self._last_delta = 0
+        self._last_gain = 1
+        self._dropped = encoder.edges_dropped
+        self._update_ms = time.ticks_ms()
+        # Statistics
+        self.edges = 0
+        self.updates = 0
+        self.max_gain = 1
+
+    def set_curve(self, curve):
+        self._limits = array('L', [limit for limit, _ in curve])
+        self._gains = array('H', [gain for _, gain in curve])
+
+    def gain(self, interval_us):
+        """Multiplier for an edge interval_us after the previous one"""
+        limits = self._limits
+        for index in range(len(limits)):
+            if interval_us <= limits[index]:
+                return self._gains[index]
+        return 1
+
+    def read(self):
+        """Accelerated steps since the last read; 0 if the knob has not moved"""
+        encoder = self.encoder
+        ticks = self._ticks
+        deltas = self._deltas
+        last_us = self._last_us
+        last_delta = self._last_delta
+        gain = self._last_gain
+        total = 0
+        while True:
+            count = encoder.read_edges(ticks, deltas)
+            for index in range(count):
+                delta = deltas[index]
+                # A change of direction starts again from the slowest step
+                if delta == last_delta:
+                    gain = self.gain(time.ticks_diff(ticks[index], last_us))
+                else:
+                    gain = 1
+                last_us = ticks[index]
+                last_delta = delta
+                total += delta * gain
+            self.edges += count
+            if count < BATCH:
+                break
+        # Edges the ring had no room for belong to the same burst
+        dropped = encoder.edges_dropped - self._dropped
+        if dropped:
+            self._dropped += dropped
+            total += dropped * last_delta * gain
+        self._last_us = last_us
+        self._last_delta = last_delta
+        self._last_gain = gain
+        if gain > self.max_gain:
+            self.max_gain = gain
+        if total:
+            self.updates += 1
+        return total
+
+    async def wait(self):
+        """Sleep until the encoder has news, then until the frame is up"""
+        await self.encoder.wait()
+        if self.frame_ms:
+            delay = self.frame_ms - time.ticks_diff(time.ticks_ms(), self._update_ms)
+            if delay > 0:
+                await asyncio.sleep_ms(delay)
+            self._update_ms = time.ticks_ms()
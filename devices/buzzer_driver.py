@@ -1,19 +1,118 @@
-from machine import Pin, PWM
+from array import array
 import asyncio
+from .pwm_channel import PwmChannel
+
+# Sequencer priorities: play() cuts off anything running at the same or a
+# lower priority, otherwise the melody waits in the queue
+PRIORITY_MELODY = 0
+PRIORITY_CLICK = 1
+PRIORITY_ALERT = 2
+
+QUEUE_SIZE = 4
+
+# Octave 4 note frequencies, C to B; other octaves are shifts of these
+_OCTAVE_4 = array('H', [262, 277, 294, 311, 330, 349, 370, 392, 415, 440, 466, 494])
+_NOTE_INDEX = {'c': 0, 'd': 2, 'e': 4, 'f': 5, 'g': 7, 'a': 9, 'b': 11, 'h': 11}
+
+def compile_melody(notes):
+    """
+    Pack (frequency, duration_ms) pairs into a flat array('H') the
+    sequencer plays without further allocation. Frequency 0 is a rest.
+    """
+    melody = array('H')
+    for freq, duration in notes:
+        melody.append(freq)
+        melody.append(duration)
+    return melody
+
+def note_frequency(name, octave):
+    """'c', 'f#', ... in octave 4-7 -> Hz"""
+    index = _NOTE_INDEX[name[0]] + (1 if name.endswith('#') else 0)
+    freq = _OCTAVE_4[index % 12] << (index // 12)
+    return freq << (octave - 4) if octave >= 4 else freq >> (4 - octave)
+
+def parse_rtttl(text, gap_ms=10):
+    """
+    Compile an RTTTL ringtone ("name:d=4,o=5,b=100:8c6,8e6,4g6,...") into
+    the same format as compile_melody(). Parse once, play as often as needed.
+    """
+    _, settings, body = text.split(':')
+    defaults = {'d': 4, 'o': 6, 'b': 63}
+    for item in settings.split(','):
+        if '=' in item:
+            key, value = item.strip().split('=')
+            defaults[key.strip().lower()] = int(value)
+    whole_ms = 4 * 60000 // defaults['b']
+    melody = array('H')
+    for token in body.split(','):
+        token = token.strip().lower()
+        if not token:
+            continue
+        pos = 0
+        while pos < len(token) and token[pos].isdigit():
+            pos += 1
+        duration = int(token[:pos]) if pos else defaults['d']
+        name = token[pos]
+        pos += 1
+        if pos < len(token) and token[pos] == '#':
+            name += '#'
+            pos += 1
+        dotted = '.' in token[pos:]
+        digits = ''.join(ch for ch in token[pos:] if ch.isdigit())
+        octave = int(digits) if digits else defaults['o']
+        length = whole_ms // duration
+        if dotted:
+            length += length // 2
+        freq = 0 if name == 'p' else note_frequency(name, octave)
+        melody.append(freq)
+        melody.append(max(0, length - gap_ms) if freq else length)
+        if freq and gap_ms:
+            melody.append(0)
+            melody.append(gap_ms)
+    return melody
 
 class BuzzerDriver:
-    def __init__(self, pin_number):
-        self.buzzer_pin = Pin(pin_number)
-        self.pwm = PWM(self.buzzer_pin, freq=440)  # Default to A4 note
-        self.pwm.duty_u16(0)  # Start silent
-        
+    def __init__(self, pin_number, volume=32768, start=True):
+        """
+        With start=False no hardware is touched until run() (or start())
+        is called; sounds played before then wait in the queue.
+        """
+        self.pin_number = pin_number
+        self.pwm = None
+        self.volume = volume
+
+        # Background sequencer state (see run())
+        self._queue = [None] * QUEUE_SIZE
+        self._queue_priority = bytearray(QUEUE_SIZE)
+        self._queue_head = 0
+        self._queued = 0
+        self._melody = None
+        self._priority = 0
+        self._position = 0
+        self._tones = {}  # Compiled single tones, so repeated clicks don't allocate
+        self._wake = asyncio.ThreadSafeFlag()
+        self.dropped = 0  # Melodies refused because the queue was full
+        if start:
+            self.start()
+
+    @property
+    def writes(self):
+        """PWM register writes made so far"""
+        return self.pwm.writes if self.pwm else 0
+
+    def start(self):
+        """Set up the PWM if that has not happened yet"""
+        if self.pwm is None:
+            self.pwm = PwmChannel(self.pin_number, 440)  # A4, silent
+
     async def play_tone(self, frequency, duration_ms=100, duty=32768):
         """Play a tone at specified frequency for duration_ms milliseconds"""
-        self.pwm.freq(frequency)
-        self.pwm.duty_u16(duty)  # 50% duty cycle
+        self.start()
+        self.pwm.set_freq(frequency)
+        self.pwm.write(duty)  # 50% duty cycle
         await asyncio.sleep_ms(duration_ms)
-        self.pwm.duty_u16(0)
-        
+        self.pwm.off()
+
     async def play_melody(self, notes):
         """
         Play a sequence of notes
@@ -22,10 +121,97 @@ class BuzzerDriver:
         for freq, duration in notes:
             await self.play_tone(freq, duration)
             await asyncio.sleep_ms(50)  # Small gap between notes
-            
+
+    def play(self, melody, priority=PRIORITY_MELODY):
+        """
+        Hand a compiled melody to the sequencer without waiting for it.
+        Returns False if it had to be dropped because the queue was full.
+        """
+        if self._melody is None or priority >= self._priority:
+            # Idle, or preempting what is playing now
+            self._melody = melody
+            self._priority = priority
+            self._position = 0
+            self._wake.set()
+            return True
+        if self._queued == QUEUE_SIZE:
+            self.dropped += 1
+            return False
+        slot = (self._queue_head + self._queued) % QUEUE_SIZE
+        self._queue[slot] = melody
+        self._queue_priority[slot] = priority
+        self._queued += 1
+        return True
+
+    def tone(self, frequency, duration_ms=100, priority=PRIORITY_CLICK):
+        """Queue a single tone; see play()"""
+        key = (frequency << 16) | duration_ms
+        melody = self._tones.get(key)
+        if melody is None:
+            melody = self._tones[key] = array('H', [frequency, duration_ms])
+        return self.play(melody, priority)
+
+    def subscribe(self, bus, tone=None, tune=None, tunes=(), priority=PRIORITY_CLICK):
+        """
+        Play from a core.events.EventBus: `tone` events carry
+        frequency << 16 | duration_ms, `tune` events an index into tunes.
+        """
+        if tone is not None:
+            bus.subscribe(tone, lambda value: self.tone(value >> 16, value & 0xffff, priority))
+        if tune is not None:
+            bus.subscribe(tune, lambda index: self.play(tunes[index], priority))
+
+    def playing(self):
+        """True while the sequencer has something to play"""
+        return self._melody is not None
+
+    def _next_melody(self):
+        if not self._queued:
+            self._melody = None
+            return
+        head = self._queue_head
+        self._melody = self._queue[head]
+        self._priority = self._queue_priority[head]
+        self._position = 0
+        self._queue[head] = None
+        self._queue_head = (head + 1) % QUEUE_SIZE
+        self._queued -= 1
+
+    async def run(self):
+        """Background sequencer task; sleeps while there is nothing to play"""
+        self.start()
+        while True:
+            melody = self._melody
+            if melody is None:
+                await self._wake.wait()
+                continue
+            position = self._position
+            if position >= len(melody):
+                self.pwm.off()
+                self._next_melody()
+                continue
+            freq = melody[position]
+            duration = melody[position + 1]
+            self._position = position + 2
+            if freq:
+                self.pwm.set_freq(freq)
+                self.pwm.write(self.volume)
+            else:
+                self.pwm.off()
+            self._wake.clear()
+            try:
+                # A preempting play() wakes us early
+                await asyncio.wait_for_ms(self._wake.wait(), duration)
+            except asyncio.TimeoutError:
+                pass
+
     def stop(self):
         """Stop playing sound"""
-        self.pwm.duty_u16(0)
-        
+        self._melody = None
+        self._queued = 0
+        if self.pwm:
+            self.pwm.off()
+
     def deinit(self):
-        self.pwm.deinit() 
\ No newline at end of file
+        if self.pwm:
+            self.pwm.deinit()
@@ -0,0 +1,118 @@
+from array import array
+import asyncio
+import time
+
+DIGITS = 10
+MIN_PULSE_US = 1000
+MAX_PULSE_US = 2000
+DAY_MS = 24 * 60 * 60 * 1000
+_UNKNOWN = 0xff
+
+def default_table(servos=4):
+    """Digits 0-9 spread evenly over 1.0-2.0 ms on every servo"""
+    span = MAX_PULSE_US - MIN_PULSE_US
+    return array('H', [MIN_PULSE_US + digit * span // (DIGITS - 1)
+                       for _ in range(servos) for digit in range(DIGITS)])
+
+class ClockFace:
+    def __init__(self, display, table=None, show_seconds=False):
+        """
+        Show HH:MM (or MM:SS) on a four-channel ServoDisplay, or HH:MM:SS
+        on a six-channel one, one digit per servo. table is a flat
+        array('H') of pulse widths in microseconds, DIGITS entries per
+        servo; adjust it with calibrate().
+        """
+        servos = display.channels
+        if servos not in (4, 6):
+            raise ValueError("ClockFace needs a 4 or 6 channel display")
+        self.display = display
+        self.table = table if table is not None else default_table(servos)
+        show_seconds = show_seconds or servos == 6
+        self.period_ms = 1000 if show_seconds else 60000
+        self.show_seconds = show_seconds
+        self.enabled = True
+        self.shown = bytearray([_UNKNOWN] * servos)
+        self._digits = bytearray(servos)
+        # Wall time is kept against ticks_ms so sleeps land on boundaries
+        hours, minutes, seconds = time.localtime()[3:6]
+        self.set_time(hours, minutes, seconds)
+
+    def set_time(self, hours, minutes, seconds=0):
+        self._anchor_ticks = time.ticks_ms()
+        self._anchor_ms = ((hours * 60 + minutes) * 60 + seconds) * 1000
+
+    def now_ms(self, ticks=None):
+        """Milliseconds since midnight, at ticks_ms `ticks` (default: now)"""
+        if ticks is None:
+            ticks = time.ticks_ms()
+        elapsed = time.ticks_diff(ticks, self._anchor_ticks)
+        return (self._anchor_ms + elapsed) % DAY_MS
+
+    def calibrate(self, servo, digit, pulse_width_us):
+        self.table[servo * DIGITS + digit] = pulse_width_us
+        self.shown[servo] = _UNKNOWN
+
+    def show(self, day_ms):
+        """Stage and commit the servos whose digit differs from what is shown"""
+        seconds = day_ms // 1000
+        digits = self._digits
+        # Fill from the right: SS, then MM, then HH as far as servos go
+        if self.show_seconds:
+            fields = (seconds % 60, seconds // 60 % 60, seconds // 3600)
+        else:
+            fields = (seconds // 60 % 60, seconds // 3600)
+        servo = len(digits)
+        for value in fields:
+            if servo == 0:
+                break
+            digits[servo - 1] = value % 10
+            digits[servo - 2] = value // 10
+            servo -= 2
+        shown = self.shown
+        changed = False
+        for servo in range(len(digits)):
+            digit = digits[servo]
+            if digit != shown[servo]:
+                self.display.stage_us(servo, self.table[servo * DIGITS + digit])
+                shown[servo] = digit
+                changed = True
+        return self.display.commit() if changed else 0
+
+    def pause(self):
+        """Stop drawing so something else can drive the servos"""
+        self.enabled = False
+
+    def resume(self):
+        """Take the display back and redraw every digit"""
+        for servo in range(len(self.shown)):
+            self.shown[servo] = _UNKNOWN
+        self.enabled = True
+        self.show(self.now_ms())
+
+    def ms_to_next(self):
+        """Milliseconds until the next minute (or second) boundary"""
+        return self.period_ms - self.now_ms() % self.period_ms
+
+    def tick(self, now=None):
+        """Redraw for ticks_ms `now` (the scheduler's, or read here)"""
+        if now is None:
+            now = time.ticks_ms()
+        # Re-anchor so ticks_ms wrap-around never matters; both from the
+        # one reading, or a millisecond could slip between them for good
+        day_ms = self.now_ms(now)
+        self._anchor_ticks = now
+        self._anchor_ms = day_ms
+        if self.enabled:
+            self.show(day_ms)
+
+    def schedule(self, scheduler, priority=0):
+        """Tick from a core.scheduler.Scheduler, phase-locked to the boundaries"""
+        self.tick()
+        return scheduler.add(self.tick, self.period_ms, priority, 'clock',
+                             delay_ms=self.ms_to_next())
+
+    async def run(self):
+        """Redraw on every minute (or second) boundary and sleep in between"""
+        while True:
+            self.tick()
+            await asyncio.sleep_ms(self.ms_to_next())
@@ -0,0 +1,42 @@
+from array import array
+
+GAMMA_EXPONENT = 2.2
+ONE = 1024  # Fixed-point 1.0 for mix()
+
+# 8-bit perceptual level -> 16-bit PWM duty, built once at import
+GAMMA = array('H', [int(65535 * (level / 255) ** GAMMA_EXPONENT + 0.5) for level in range(256)])
+
+class ColorLevels:
+    def __init__(self, intensity=255):
+        """
+        256-entry lookup of 8-bit colour component -> gamma-corrected duty
+        at the current intensity. Rebuilt only when the intensity changes,
+        so converting a colour is one table lookup per channel.
+        """
+        self.lut = array('H', GAMMA)
+        self.intensity = 255
+        self.set_intensity(intensity)
+
+    def set_intensity(self, intensity):
+        if intensity == self.intensity:
+            return
+        lut = self.lut
+        for level in range(256):
+            lut[level] = GAMMA[level * intensity // 255]
+        self.intensity = intensity
+
+    def write(self, red_pwm, green_pwm, blue_pwm, red, green, blue):
+        """Send an 8-bit colour to three PwmChannels"""
+        lut = self.lut
+        red_pwm.write(lut[red])
+        green_pwm.write(lut[green])
+        blue_pwm.write(lut[blue])
+
+def mix(out, start, end, progress):
+    """
+    Blend two colours into out (a preallocated bytearray/array) in place.
+    progress runs from 0 (start) to ONE (end).
+    """
+    for channel in range(3):
+        out[channel] = start[channel] + (end[channel] - start[channel]) * progress // ONE
+    return out
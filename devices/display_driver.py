@@ -1,33 +1,307 @@
-from .servo_driver import ServoDriver
+from .servo_driver import ServoDriver, PERIOD_US
+from array import array
 import asyncio
+import time
 
-class ServoDisplay:
+# Motion profiles for MotionPlanner
+LINEAR = 0
+EASE = 1       # Smoothstep: zero speed at both ends
+TRAPEZOID = 2  # Constant acceleration, cruise, constant deceleration
+
+ONE = 1024  # Fixed-point 1.0 for progress and position fractions
+
+_IDLE = 0
+_WAITING = 1
+_MOVING = 2
+
+class PwmBackend:
     def __init__(self, servo_pins):
-        if len(servo_pins) != 4:
-            raise ValueError("ServoDisplay requires exactly 4 servo pins")
-        
+        """One on-chip PWM slice per servo"""
         self.servos = [ServoDriver(pin) for pin in servo_pins]
+        self.channels = len(self.servos)
+        self.period_us = PERIOD_US
+        self.duty = array('H', [servo.duty for servo in self.servos])
+        # Kept as a plain int so reading it from a commit callback doesn't allocate
+        self.writes = sum(servo.writes for servo in self.servos)
         
-    async def set_all_positions(self, position):
-        # Create tasks for all servos to move simultaneously
-        await asyncio.gather(
-            *[servo.set_pulse_width(position) for servo in self.servos]
-        )
-            
-    async def sweep_all(self, start_pos, end_pos, step=0.1):
-        current_pos = start_pos
-        while current_pos <= end_pos:
-            await self.set_all_positions(current_pos)
-            current_pos += step
-            await asyncio.sleep_ms(50)
-            
-    async def set_individual_positions(self, positions):
-        if len(positions) != 4:
-            raise ValueError("Must provide 4 positions")
-        await asyncio.gather(
-            *[servo.set_pulse_width(pos) for servo, pos in zip(self.servos, positions)]
-        )
+    def write(self, frame):
+        """Write the channels whose duty changed; returns how many"""
+        servos = self.servos
+        duty = self.duty
+        written = 0
+        for index in range(self.channels):
+            if servos[index].write_duty(frame[index]):
+                duty[index] = frame[index]
+                written += 1
+        self.writes += written
+        return written
+        
+    def detach(self):
+        servos = self.servos
+        for index in range(self.channels):
+            if servos[index].off():
+                self.writes += 1
+            self.duty[index] = 0
             
     def deinit(self):
         for servo in self.servos:
-            servo.deinit() 
\ No newline at end of file
+            servo.deinit()
+
+
+class ServoDisplay:
+    def __init__(self, servo_pins=None, backend=None):
+        """
+        Any number of servo channels behind a backend: PwmBackend (the
+        default, built from servo_pins) or e.g. devices.pca9685's
+        PCA9685Backend. A backend has `channels`, its PWM `period_us`, the
+        `duty` it last wrote, write(frame) returning how many channels
+        changed, detach(), deinit() and a `writes` count of hardware writes.
+        """
+        if backend is None:
+            if not servo_pins:
+                raise ValueError("ServoDisplay needs servo pins or a backend")
+            backend = PwmBackend(servo_pins)
+        self.backend = backend
+        self.channels = backend.channels
+        self.period_us = backend.period_us
+        # Duty for every channel in the next frame; commit() sends it
+        self.frame = array('H', backend.duty)
+        self.on_commit = None  # Called after a commit() that wrote something (core.idle)
+        
+    def duty_for(self, pulse_width_us):
+        """16-bit duty for a pulse width in microseconds at the backend's period"""
+        return pulse_width_us * 65535 // self.period_us
+        
+    def stage_us(self, index, pulse_width_us):
+        """Stage one servo's pulse width (microseconds) for the next commit"""
+        self.frame[index] = self.duty_for(pulse_width_us)
+        
+    def stage(self, index, pulse_width_ms):
+        self.stage_us(index, int(pulse_width_ms * 1000))
+        
+    def stage_all(self, pulse_width_ms):
+        duty = self.duty_for(int(pulse_width_ms * 1000))
+        frame = self.frame
+        for index in range(len(frame)):
+            frame[index] = duty
+            
+    def commit(self):
+        """
+        Send the staged frame in one pass, skipping channels whose duty
+        has not changed. Returns the number of channels updated.
+        """
+        written = self.backend.write(self.frame)
+        if written and self.on_commit:
+            self.on_commit()
+        return written
+        
+    def detach(self):
+        """
+        Stop the pulses so settled servos go quiet and draw no holding
+        current. The frame is kept; the next commit() reattaches them.
+        """
+        self.backend.detach()
+            
+    @property
+    def writes(self):
+        """Hardware writes made so far (PWM registers or bus transactions)"""
+        return self.backend.writes
+        
+    def set_all_positions(self, position):
+        self.stage_all(position)
+        self.commit()
+            
+    async def sweep_all(self, start_pos, end_pos, step=0.1, planner=None):
+        """
+        Sweep at the old pace of one step per 50 ms on a MotionPlanner, so
+        a planner passed in applies its max_speed and max_moving limits
+        """
+        if planner is None:
+            planner = MotionPlanner(self, profile=LINEAR)
+        planner.jump_all(start_pos)
+        planner.move_all(end_pos, int(abs(end_pos - start_pos) / step * 50))
+        await planner.run_until_idle()
+            
+    def set_individual_positions(self, positions):
+        if len(positions) != self.channels:
+            raise ValueError("Must provide %d positions" % self.channels)
+        for index, pos in enumerate(positions):
+            self.stage(index, pos)
+        self.commit()
+            
+    def deinit(self):
+        self.backend.deinit()
+
+
+class MotionPlanner:
+    def __init__(self, display, frame_ms=20, profile=TRAPEZOID, max_speed=None,
+                 max_moving=None, ramp=ONE // 4):
+        """
+        Time-based servo trajectories for a ServoDisplay.
+        frame_ms: output frame period; late frames are dropped, never replayed
+        max_speed: peak pulse-width change in microseconds per second
+        max_moving: how many servos may be in motion at once; the rest wait
+        ramp: TRAPEZOID acceleration time as a fraction of ONE per end
+        """
+        count = display.channels
+        self.display = display
+        self.frame_ms = frame_ms
+        self.profile = profile
+        self.max_speed = max_speed
+        self.max_moving = max_moving or count
+        self.ramp = ramp
+        # Peak speed relative to a linear move of the same length (ONE = 1x)
+        if profile == EASE:
+            self._peak = ONE * 3 // 2
+        elif profile == TRAPEZOID:
+            self._peak = ONE * ONE // (ONE - ramp)
+        else:
+            self._peak = ONE
+        
+        self.position_us = array('H', [duty * display.period_us // 65535 for duty in display.frame])
+        self._from_us = array('H', self.position_us)
+        self._to_us = array('H', self.position_us)
+        self._start = array('L', [0] * count)
+        self._duration = array('L', [0] * count)
+        self._requested = array('L', [0] * count)
+        self._state = bytearray(count)
+        self._moving = 0
+        self._pending = 0
+        self.frames_dropped = 0
+        self.job = None
+        self._wake = asyncio.ThreadSafeFlag()
+        
+    def schedule(self, scheduler, priority=0):
+        """Run frames from a core.scheduler.Scheduler instead of run()"""
+        self.job = scheduler.add(self._frame, self.frame_ms, priority, 'servos')
+        if not self.busy:
+            self.job.pause()
+        return self.job
+        
+    def _frame(self, now):
+        self.tick(now)
+        return self.busy
+        
+    @property
+    def busy(self):
+        return self._moving + self._pending > 0
+        
+    def jump_all(self, pulse_width_ms):
+        """Set every servo immediately, cancelling any motion"""
+        pulse_us = int(pulse_width_ms * 1000)
+        for index in range(len(self._state)):
+            self._state[index] = _IDLE
+            self.position_us[index] = pulse_us
+            self.display.stage_us(index, pulse_us)
+        self._moving = self._pending = 0
+        self.display.commit()
+        
+    def move(self, index, pulse_width_ms, duration_ms=0):
+        """Queue a move; it starts on the next frame with a free slot"""
+        state = self._state[index]
+        if state == _MOVING:
+            # Retarget from wherever the servo is now
+            self._moving -= 1
+        if state != _WAITING:
+            self._pending += 1
+        self._state[index] = _WAITING
+        self._to_us[index] = int(pulse_width_ms * 1000)
+        self._requested[index] = duration_ms
+        if self.job:
+            self.job.resume()
+        else:
+            self._wake.set()
+        
+    def move_all(self, pulse_width_ms, duration_ms=0):
+        for index in range(len(self._state)):
+            self.move(index, pulse_width_ms, duration_ms)
+            
+    def move_to(self, positions, duration_ms=0):
+        for index, pos in enumerate(positions):
+            self.move(index, pos, duration_ms)
+            
+    async def play(self, keyframes):
+        """
+        keyframes: sequence of (duration_ms, positions). Each keyframe starts
+        once the previous one has finished; run() must be running.
+        """
+        for duration_ms, positions in keyframes:
+            self.move_to(positions, duration_ms)
+            while self.busy:
+                await asyncio.sleep_ms(self.frame_ms)
+                
+    def _start_move(self, index, now):
+        start_us = self.position_us[index]
+        distance = abs(self._to_us[index] - start_us)
+        duration = self._requested[index]
+        if self.max_speed and start_us:
+            duration = max(duration, distance * self._peak * 1000 // (ONE * self.max_speed))
+        self._from_us[index] = start_us or self._to_us[index]
+        self._start[index] = now
+        self._duration[index] = duration
+        self._state[index] = _MOVING
+        self._pending -= 1
+        self._moving += 1
+        
+    def _shape(self, progress):
+        """Map time progress (0..ONE) to distance covered (0..ONE)"""
+        if self.profile == EASE:
+            return progress * progress * (3 * ONE - 2 * progress) // (ONE * ONE)
+        if self.profile == TRAPEZOID:
+            ramp = self.ramp
+            peak = self._peak
+            if progress < ramp:
+                return peak * progress * progress // (2 * ramp * ONE)
+            if progress > ONE - ramp:
+                rest = ONE - progress
+                return ONE - peak * rest * rest // (2 * ramp * ONE)
+            return peak * (progress - ramp // 2) // ONE
+        return progress
+        
+    def tick(self, now=None):
+        """Compute and commit the frame for time `now` (ticks_ms)"""
+        if now is None:
+            now = time.ticks_ms()
+        state = self._state
+        display = self.display
+        for index in range(len(state)):
+            if state[index] == _WAITING and self._moving < self.max_moving:
+                self._start_move(index, now)
+            if state[index] != _MOVING:
+                continue
+            elapsed = time.ticks_diff(now, self._start[index])
+            duration = self._duration[index]
+            start_us = self._from_us[index]
+            target_us = self._to_us[index]
+            if elapsed >= duration:
+                position = target_us
+                state[index] = _IDLE
+                self._moving -= 1
+            else:
+                covered = self._shape(elapsed * ONE // duration)
+                position = start_us + (target_us - start_us) * covered // ONE
+            self.position_us[index] = position
+            display.stage_us(index, position)
+        return display.commit()
+        
+    async def run_until_idle(self):
+        """Produce frames at frame_ms until every queued move has finished"""
+        frame_ms = self.frame_ms
+        next_frame = time.ticks_ms()
+        while self.busy:
+            now = time.ticks_ms()
+            self.tick(now)
+            next_frame = time.ticks_add(next_frame, frame_ms)
+            late = time.ticks_diff(now, next_frame)
+            if late >= 0:
+                # Behind schedule: skip the missed frames rather than slow down
+                self.frames_dropped += late // frame_ms + 1
+                next_frame = time.ticks_add(now, frame_ms)
+            if self.busy:
+                await asyncio.sleep_ms(time.ticks_diff(next_frame, time.ticks_ms()))
+                
+    async def run(self):
+        """Background task: sleep until a move is queued, then animate it"""
+        while True:
+            await self._wake.wait()
+            await self.run_until_idle()
@@ -1,41 +1,123 @@
 from machine import Pin
+from array import array
+import asyncio
 import time
+from .quadrature import QuadratureDecoder
+from .gestures import GestureRecognizer, PRESS, NONE
+
+EDGE_BUFFER_SIZE = 64  # Must be a power of two
 
 class EncoderDriver:
-    def __init__(self, clk_pin, dt_pin, sw_pin=None):
+    def __init__(self, clk_pin, dt_pin, sw_pin=None, resolution=2, reverse=False,
+                 edge_buffer=EDGE_BUFFER_SIZE, debounce_ms=20, long_press_ms=1000,
+                 double_click_ms=300, repeat_ms=0):
+        """
+        The button timings are passed to a GestureRecognizer; read its
+        events with get_gesture(), or just presses with get_button_press().
+        """
+        if edge_buffer & (edge_buffer - 1):
+            raise ValueError("edge_buffer must be a power of two")
+        
         # Rotary Encoder pins
         self.clk = Pin(clk_pin, Pin.IN, Pin.PULL_UP)
         self.dt = Pin(dt_pin, Pin.IN, Pin.PULL_UP)
         self.sw = Pin(sw_pin, Pin.IN, Pin.PULL_UP) if sw_pin is not None else None
         
         # Initialize state
+        self.decoder = QuadratureDecoder(self.clk, self.dt, resolution, reverse)
         self.counter = 0
-        self.clk_last_state = self.clk.value()
-        self.last_button_state = True if self.sw else None
         self.button_pressed = False
+        self.irq_count = 0
+        self.event_us = 0  # ticks_us of the IRQ that last set `changed`
+        self.tap = None  # Called first thing in every IRQ (core.trace)
+        
+        # Ring of (ticks_us, delta) per counted edge. The IRQ only writes
+        # the head and the consumer only writes the tail, so neither side
+        # needs a lock and the IRQ never allocates.
+        self._edge_ticks = array('L', [0] * edge_buffer)
+        self._edge_deltas = array('b', [0] * edge_buffer)
+        self._edge_mask = edge_buffer - 1
+        self._edge_head = 0
+        self._edge_tail = 0
+        self.edges_dropped = 0
         
-        # Set up interrupts
+        # Set from the IRQ handlers whenever there is something new to read
+        self.changed = asyncio.ThreadSafeFlag()
+        
+        # Set up interrupts; the decoder needs to see edges on both lines
         self.clk.irq(trigger=Pin.IRQ_FALLING | Pin.IRQ_RISING, handler=self._rotation_handler)
+        self.dt.irq(trigger=Pin.IRQ_FALLING | Pin.IRQ_RISING, handler=self._rotation_handler)
+        self.gestures = None
         if self.sw:
+            self.gestures = GestureRecognizer(self.sw, debounce_ms, long_press_ms,
+                                              double_click_ms, repeat_ms, self._gesture_event)
             self.sw.irq(trigger=Pin.IRQ_FALLING | Pin.IRQ_RISING, handler=self._button_handler)
     
     def _rotation_handler(self, pin):
         """Handle rotation interrupt"""
-        clk_state = self.clk.value()
-        if clk_state != self.clk_last_state:
-            if self.dt.value() != clk_state:
-                self.counter += 1
-            else:
-                self.counter -= 1
-            self.clk_last_state = clk_state
+        self.irq_count += 1
+        if self.tap:
+            self.tap()
+        delta = self.decoder.update()
+        if delta:
+            self.counter += delta
+            self._push_edge(delta)
+            self.event_us = time.ticks_us()
+            self.changed.set()
+    
+    def _push_edge(self, delta):
+        """Record one counted edge; called from the IRQ, must not allocate"""
+        head = self._edge_head
+        next_head = (head + 1) & self._edge_mask
+        if next_head == self._edge_tail:
+            self.edges_dropped += 1
+            return
+        self._edge_ticks[head] = time.ticks_us()
+        self._edge_deltas[head] = delta
+        self._edge_head = next_head
     
     def _button_handler(self, pin):
         """Handle button press interrupt"""
-        if self.sw:
-            current_state = self.sw.value()
-            if current_state == False and self.last_button_state == True:
-                self.button_pressed = True
-            self.last_button_state = current_state
+        self.irq_count += 1
+        if self.tap:
+            self.tap()
+        self.gestures.edge(pin)
+    
+    def _gesture_event(self, code):
+        """Called by the recognizer, from IRQ or timer context, per gesture"""
+        if code == PRESS:
+            self.button_pressed = True
+        self.event_us = time.ticks_us()
+        self.changed.set()
+    
+    async def wait(self):
+        """Sleep until the counter moves or there is a button gesture"""
+        await self.changed.wait()
+    
+    def read_edges(self, ticks_buf, delta_buf):
+        """
+        Move buffered edges, oldest first, into the caller's preallocated
+        ticks_buf (array('L')) and delta_buf (array('b')). Returns how many
+        were copied; call again while it returns a full batch.
+        """
+        ticks = self._edge_ticks
+        deltas = self._edge_deltas
+        mask = self._edge_mask
+        head = self._edge_head
+        tail = self._edge_tail
+        limit = min(len(ticks_buf), len(delta_buf))
+        count = 0
+        while tail != head and count < limit:
+            ticks_buf[count] = ticks[tail]
+            delta_buf[count] = deltas[tail]
+            tail = (tail + 1) & mask
+            count += 1
+        self._edge_tail = tail
+        return count
+    
+    def pending_edges(self):
+        """Number of edges waiting in the ring"""
+        return (self._edge_head - self._edge_tail) & self._edge_mask
     
     def get_counter(self):
         """Get current counter value"""
@@ -44,10 +126,20 @@ class EncoderDriver:
     def reset_counter(self):
         """Reset counter to zero"""
         self.counter = 0
+        self.decoder.reset()
     
     def get_button_press(self):
         """Get and clear button press state"""
         if self.button_pressed:
             self.button_pressed = False
             return True
-        return False 
\ No newline at end of file
+        return False
+    
+    def get_gesture(self):
+        """
+        Pop the oldest button gesture (see devices.gestures), or NONE.
+        Its ticks_us timestamp is in self.gestures.event_us.
+        """
+        if self.gestures is None:
+            return NONE
+        return self.gestures.get() 
\ No newline at end of file
@@ -0,0 +1,195 @@
+from machine import Timer
+from array import array
+import time
+
+# Gesture event codes; 0 means the queue is empty
+NONE = 0
+PRESS = 1
+RELEASE = 2
+CLICK = 3
+LONG_PRESS = 4
+DOUBLE_CLICK = 5
+HOLD_REPEAT = 6
+
+NAMES = ('none', 'press', 'release', 'click', 'long_press', 'double_click', 'hold_repeat')
+
+QUEUE_SIZE = 16  # Must be a power of two
+
+class GestureRecognizer:
+    def __init__(self, pin, debounce_ms=20, long_press_ms=1000, double_click_ms=300,
+                 repeat_ms=0, on_event=None, queue_size=QUEUE_SIZE):
+        """
+        Turn the edges of an active-low button into gestures. Call edge()
+        from an IRQ on both edges of the pin; deadlines (end of debounce,
+        long press, hold repeat, double-click window) run from a one-shot
+        machine.Timer, so nothing has to poll. Every gesture is stamped
+        with the ticks_us of the edge it derives from.
+
+        double_click_ms=0 turns double clicks off and reports CLICK on
+        release; otherwise CLICK waits until the window has passed.
+        repeat_ms=0 turns hold repeat off. on_event(code) is called from
+        IRQ context for every gesture, even one the full queue dropped.
+        """
+        if queue_size & (queue_size - 1):
+            raise ValueError("queue_size must be a power of two")
+        self.pin = pin
+        self.debounce_us = debounce_ms * 1000
+        self.long_press_us = long_press_ms * 1000
+        self.double_click_us = double_click_ms * 1000
+        self.repeat_us = repeat_ms * 1000
+        self.on_event = on_event
+
+        # Debounced state: the first edge counts, the rest of the bounce is
+        # ignored and the level is checked again once it has settled
+        self.pressed = pin.value() == 0
+        self._changed_us = time.ticks_us()
+        self._settle = False
+        self._press_us = 0
+        self._release_us = 0
+        self._long = False  # LONG_PRESS sent for the current press
+        self._next_repeat_us = 0
+        self._clicks = 0  # Releases waiting for the double-click window
+
+        # Queue of (code, ticks_us), written here and read by get()
+        self._codes = bytearray(queue_size)
+        self._ticks = array('L', [0] * queue_size)
+        self._mask = queue_size - 1
+        self._head = 0
+        self._tail = 0
+        self.dropped = 0
+        self.event_us = 0  # Timestamp of the last event returned by get()
+
+        self._timer = Timer(-1)
+        self._timer_armed = False
+        self._on_timer = self._timeout  # Bound once so arming doesn't allocate
+
+    def _emit(self, code, ticks):
+        head = self._head
+        next_head = (head + 1) & self._mask
+        if next_head == self._tail:
+            # Still tell on_event, so flag-style readers see the press
+            self.dropped += 1
+        else:
+            self._codes[head] = code
+            self._ticks[head] = ticks
+            self._head = next_head
+        if self.on_event:
+            self.on_event(code)
+
+    def edge(self, pin=None):
+        """Pin IRQ handler"""
+        now = time.ticks_us()
+        if time.ticks_diff(now, self._changed_us) < self.debounce_us:
+            self._settle = True
+            return
+        self._update(now)
+        self._arm(now)
+
+    def _update(self, now):
+        pressed = self.pin.value() == 0
+        if pressed == self.pressed:
+            return
+        self.pressed = pressed
+        self._changed_us = now
+        self._settle = True
+        if pressed:
+            if self._clicks and time.ticks_diff(now, self._release_us) > self.double_click_us:
+                # The window ran out before its timer got to run
+                self._clicks = 0
+                self._emit(CLICK, self._release_us)
+            self._press_us = now
+            self._long = False
+            self._emit(PRESS, now)
+            return
+        self._release_us = now
+        self._emit(RELEASE, now)
+        if self._long:
+            self._clicks = 0
+        elif not self.double_click_us:
+            self._emit(CLICK, now)
+        elif self._clicks:
+            self._clicks = 0
+            self._emit(DOUBLE_CLICK, now)
+        else:
+            self._clicks = 1
+
+    def _deadlines(self, now):
+        """Emit what is due at `now`; return the us until the next deadline or -1"""
+        wait = -1
+        if self._settle:
+            left = self.debounce_us - time.ticks_diff(now, self._changed_us)
+            if left > 0:
+                wait = left
+            else:
+                self._settle = False
+                self._update(now)
+                if self._settle:
+                    wait = self.debounce_us
+        if self.pressed:
+            if not self._long:
+                due = time.ticks_add(self._press_us, self.long_press_us)
+                left = time.ticks_diff(due, now)
+                if left <= 0:
+                    self._long = True
+                    if self._clicks:
+                        # The first click of a would-be double click
+                        self._clicks = 0
+                        self._emit(CLICK, self._release_us)
+                    self._emit(LONG_PRESS, due)
+                    self._next_repeat_us = time.ticks_add(due, self.repeat_us)
+                    left = self.repeat_us if self.repeat_us else -1
+            elif self.repeat_us:
+                left = time.ticks_diff(self._next_repeat_us, now)
+                if left <= 0:
+                    self._emit(HOLD_REPEAT, self._next_repeat_us)
+                    self._next_repeat_us = time.ticks_add(self._next_repeat_us, self.repeat_us)
+                    left = time.ticks_diff(self._next_repeat_us, now)
+            else:
+                left = -1
+            if left > 0 and (wait < 0 or left < wait):
+                wait = left
+        elif self._clicks:
+            due = time.ticks_add(self._release_us, self.double_click_us)
+            left = time.ticks_diff(due, now)
+            if left <= 0:
+                self._clicks = 0
+                self._emit(CLICK, self._release_us)
+            elif wait < 0 or left < wait:
+                wait = left
+        return wait
+
+    def _arm(self, now):
+        wait = self._deadlines(now)
+        if wait < 0:
+            if self._timer_armed:
+                self._timer.deinit()
+                self._timer_armed = False
+            return
+        self._timer.init(mode=Timer.ONE_SHOT, period=(wait + 999) // 1000,
+                         callback=self._on_timer)
+        self._timer_armed = True
+
+    def _timeout(self, timer):
+        self._timer_armed = False
+        self._arm(time.ticks_us())
+
+    def get(self):
+        """
+        Pop the oldest gesture code, or NONE. Its ticks_us timestamp is
+        left in self.event_us.
+        """
+        tail = self._tail
+        if tail == self._head:
+            return NONE
+        code = self._codes[tail]
+        self.event_us = self._ticks[tail]
+        self._tail = (tail + 1) & self._mask
+        return code
+
+    def pending(self):
+        """Number of gestures waiting in the queue"""
+        return (self._head - self._tail) & self._mask
+
+    def deinit(self):
+        self._timer.deinit()
+        self._timer_armed = False
@@ -1,27 +1,186 @@
-from machine import Pin, PWM
+from array import array
 import asyncio
+import time
+from .color import ColorLevels
+from .pwm_channel import PwmChannel
+from .timeline import Timeline, TimelinePlayer
+
+ONE = 1024  # Fixed-point 1.0 for fade progress
+BLACK = (0, 0, 0)
 
 class RGBLedDriver:
-    def __init__(self, red_pin, green_pin, blue_pin):
+    def __init__(self, red_pin, green_pin, blue_pin, gamma=False):
         # Initialize RGB LED pins
-        self.pwm_red = PWM(Pin(red_pin), freq=1000)
-        self.pwm_green = PWM(Pin(green_pin), freq=1000)
-        self.pwm_blue = PWM(Pin(blue_pin), freq=1000)
+        self.pwm_red = PwmChannel(red_pin, 1000)
+        self.pwm_green = PwmChannel(green_pin, 1000)
+        self.pwm_blue = PwmChannel(blue_pin, 1000)
+        # With gamma, 16-bit colours are treated as perceptual levels
+        self.levels = ColorLevels() if gamma else None
+        
+    @property
+    def writes(self):
+        """PWM register writes made on all three channels"""
+        return self.pwm_red.writes + self.pwm_green.writes + self.pwm_blue.writes
         
     def set_color(self, red, green, blue):
-        self.pwm_red.duty_u16(red)
-        self.pwm_green.duty_u16(green)
-        self.pwm_blue.duty_u16(blue)
+        levels = self.levels
+        if levels is not None:
+            lut = levels.lut
+            red = lut[red >> 8]
+            green = lut[green >> 8]
+            blue = lut[blue >> 8]
+        self.pwm_red.write(red)
+        self.pwm_green.write(green)
+        self.pwm_blue.write(blue)
+        
+    def set_rgb(self, red, green, blue):
+        """Set an 8-bit colour, through the gamma/intensity table if enabled"""
+        if self.levels is None:
+            self.set_color(red * 257, green * 257, blue * 257)
+        else:
+            self.levels.write(self.pwm_red, self.pwm_green, self.pwm_blue, red, green, blue)
+        
+    def set_intensity(self, intensity):
+        """Scale everything by intensity (0-255); needs gamma=True"""
+        self.levels.set_intensity(intensity)
+        
+    def subscribe(self, bus, event_type, color, intensity=None):
+        """
+        Show the 8-bit colour held in `color` (a buffer the poster fills
+        in) on every event_type event of a core.events.EventBus. With
+        `intensity`, events of that type carry a new intensity (0-255).
+        """
+        bus.subscribe(event_type, lambda _: self.set_rgb(color[0], color[1], color[2]))
+        if intensity is not None:
+            bus.subscribe(intensity, self.set_intensity)
         
     async def smooth_transition(self, start_color, end_color, steps):
-        for step in range(steps + 1):
-            red = int(start_color[0] + (end_color[0] - start_color[0]) * step / steps)
-            green = int(start_color[1] + (end_color[1] - start_color[1]) * step / steps)
-            blue = int(start_color[2] + (end_color[2] - start_color[2]) * step / steps)
-            self.set_color(red, green, blue)
-            await asyncio.sleep_ms(100)
+        """Fade in steps + 1 frames 100 ms apart, played from a timer"""
+        timeline = Timeline(100)
+        timeline.fade(timeline.led(self), start_color, end_color, 0, steps * 100)
+        await TimelinePlayer(timeline.compile()).play()
             
     def deinit(self):
         self.pwm_red.deinit()
         self.pwm_green.deinit()
-        self.pwm_blue.deinit() 
\ No newline at end of file
+        self.pwm_blue.deinit() 
+
+
+class LedAnimator:
+    def __init__(self, led, frame_ms=20):
+        """
+        Runs fades, pulses and colour cycles for an RGBLedDriver from a
+        single background task (run()). Commands return immediately; a new
+        command takes over from whatever colour is showing at that moment.
+        """
+        self.led = led
+        self.frame_ms = frame_ms
+        self.color = array('H', [0, 0, 0])  # What the LED shows now
+        self._from = array('H', [0, 0, 0])
+        self._to = array('H', [0, 0, 0])
+        self._palette = (BLACK,)
+        self._index = 0
+        self._segments = 0  # Segments left after this one; -1 repeats forever
+        self._start = 0
+        self._duration = 0
+        self.active = False
+        self.job = None
+        self._wake = asyncio.ThreadSafeFlag()
+        
+    def schedule(self, scheduler, priority=0):
+        """Run frames from a core.scheduler.Scheduler instead of run()"""
+        self.job = scheduler.add(self.tick, self.frame_ms, priority, 'led')
+        if not self.active:
+            self.job.pause()
+        return self.job
+        
+    def _begin(self, palette, segment_ms, segments, start=None):
+        if start is not None:
+            self._write(start[0], start[1], start[2])
+        self._palette = palette
+        self._index = 0
+        self._segments = segments
+        self._duration = max(1, segment_ms)
+        self._segment(time.ticks_ms())
+        self.active = True
+        if self.job:
+            self.job.resume()
+        else:
+            self._wake.set()
+        
+    def _segment(self, now):
+        color = self._palette[self._index % len(self._palette)]
+        for channel in range(3):
+            self._from[channel] = self.color[channel]
+            self._to[channel] = color[channel]
+        self._start = now
+        
+    def fade(self, color, duration_ms, start=None):
+        """Fade to color, from start if given or else from the current colour"""
+        self._begin((color,), duration_ms, 0, start)
+        
+    def pulse(self, color, period_ms, count=0):
+        """Breathe between color and off; count pulses, or forever if 0"""
+        self._begin((color, BLACK), period_ms // 2, count * 2 - 1 if count else -1)
+        
+    def cycle(self, colors, segment_ms):
+        """Fade through colors in order, forever"""
+        self._begin(tuple(colors), segment_ms, -1)
+        
+    def set(self, color):
+        """Show color immediately and stop any animation"""
+        self.active = False
+        self._write(color[0], color[1], color[2])
+        
+    def stop(self):
+        """Freeze on the current colour"""
+        self.active = False
+        
+    def _write(self, red, green, blue):
+        color = self.color
+        if red != color[0] or green != color[1] or blue != color[2]:
+            color[0] = red
+            color[1] = green
+            color[2] = blue
+            self.led.set_color(red, green, blue)
+            
+    def tick(self, now=None):
+        """Write the frame for time `now` (ticks_ms); False once idle"""
+        if not self.active:
+            return False
+        if now is None:
+            now = time.ticks_ms()
+        elapsed = time.ticks_diff(now, self._start)
+        if elapsed >= self._duration:
+            self._write(self._to[0], self._to[1], self._to[2])
+            if self._segments == 0:
+                self.active = False
+                return False
+            if self._segments > 0:
+                self._segments -= 1
+            self._index += 1
+            # Start the next segment where this one should have ended
+            self._segment(time.ticks_add(self._start, self._duration))
+            return True
+        progress = elapsed * ONE // self._duration
+        start = self._from
+        end = self._to
+        self._write(start[0] + (end[0] - start[0]) * progress // ONE,
+                    start[1] + (end[1] - start[1]) * progress // ONE,
+                    start[2] + (end[2] - start[2]) * progress // ONE)
+        return True
+        
+    async def run(self):
+        """Background task: sleep while idle, otherwise one frame per frame_ms"""
+        frame_ms = self.frame_ms
+        while True:
+            await self._wake.wait()
+            next_frame = time.ticks_ms()
+            while self.tick():
+                next_frame = time.ticks_add(next_frame, frame_ms)
+                delay = time.ticks_diff(next_frame, time.ticks_ms())
+                if delay < 0:
+                    # Running late: drop frames instead of catching up
+                    next_frame = time.ticks_ms()
+                    delay = 0
+                await asyncio.sleep_ms(delay)
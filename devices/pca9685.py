@@ -0,0 +1,101 @@
+from array import array
+import time
+
+# PCA9685 16-channel, 12-bit PWM controller on I2C
+_MODE1 = 0x00
+_MODE2 = 0x01
+_LED0_ON_L = 0x06
+_ALL_LED_OFF_H = 0xFD
+_PRESCALE = 0xFE
+
+_RESTART = 0x80
+_AI = 0x20      # Register auto-increment
+_SLEEP = 0x10
+_OUTDRV = 0x04  # Totem-pole outputs
+_FULL_OFF = 0x10  # Bit 4 of LEDn_OFF_H
+
+OSC_HZ = 25000000
+CHANNELS = 16
+
+class PCA9685Backend:
+    def __init__(self, i2c, address=0x40, channels=CHANNELS, freq=50):
+        """
+        ServoDisplay backend driving the first `channels` outputs of a
+        PCA9685. write() sends every changed channel in one auto-increment
+        block write, so a frame is one bus transaction whatever its size.
+        Duties are 16-bit like the on-chip PWM, rounded to the chip's 12 bits,
+        over period_us, which follows the prescaler (19988 us at 50 Hz).
+        """
+        if not 0 < channels <= CHANNELS:
+            raise ValueError("PCA9685 has 16 channels")
+        self.i2c = i2c
+        self.address = address
+        self.channels = channels
+        self.duty = array('H', [0] * channels)
+        # LEDn_ON_L, ON_H, OFF_L, OFF_H per channel, preallocated for write()
+        self._buf = bytearray(4 * channels)
+        # The buffer from each channel on, so write() sends a block without slicing
+        view = memoryview(self._buf)
+        self._tails = [view[4 * index:] for index in range(channels)]
+        self.writes = 0
+        self.set_freq(freq)
+        i2c.writeto_mem(address, _MODE2, bytes([_OUTDRV]))
+        self.detach()
+
+    def set_freq(self, freq):
+        """Set the output frequency; the prescaler only takes it while asleep"""
+        prescale = (OSC_HZ + 2048 * freq) // (4096 * freq) - 1
+        if not 3 <= prescale <= 255:
+            raise ValueError("freq out of range")
+        self.freq = OSC_HZ // (4096 * (prescale + 1))
+        # The exact period the prescaler gives, for ServoDisplay's duties
+        self.period_us = (4096 * (prescale + 1) * 1000000 + OSC_HZ // 2) // OSC_HZ
+        i2c = self.i2c
+        i2c.writeto_mem(self.address, _MODE1, bytes([_AI | _SLEEP]))
+        i2c.writeto_mem(self.address, _PRESCALE, bytes([prescale]))
+        i2c.writeto_mem(self.address, _MODE1, bytes([_AI]))
+        # The oscillator needs 500 us to start before RESTART is honoured
+        time.sleep_us(500)
+        i2c.writeto_mem(self.address, _MODE1, bytes([_AI | _RESTART]))
+        self.writes += 4
+
+    def write(self, frame):
+        """Send the channels whose duty changed as one block; returns how many"""
+        duty = self.duty
+        buf = self._buf
+        low = -1
+        changed = 0
+        for index in range(self.channels):
+            value = frame[index]
+            if value == duty[index]:
+                continue
+            duty[index] = value
+            if low < 0:
+                low = index
+            changed += 1
+            offset = 4 * index
+            count = min(4095, (value * 4096 + 32768) >> 16)
+            buf[offset] = 0
+            buf[offset + 1] = 0
+            buf[offset + 2] = count & 0xff
+            buf[offset + 3] = (count >> 8) if count else _FULL_OFF
+        if changed:
+            # Unchanged channels after the first change are rewritten as they were
+            self.i2c.writeto_mem(self.address, _LED0_ON_L + 4 * low, self._tails[low])
+            self.writes += 1
+        return changed
+
+    def detach(self):
+        """Turn every output fully off with one broadcast write"""
+        self.i2c.writeto_mem(self.address, _ALL_LED_OFF_H, bytes([_FULL_OFF]))
+        self.writes += 1
+        buf = self._buf
+        for index in range(self.channels):
+            self.duty[index] = 0
+            buf[4 * index + 2] = 0
+            buf[4 * index + 3] = _FULL_OFF
+
+    def deinit(self):
+        self.detach()
+        self.i2c.writeto_mem(self.address, _MODE1, bytes([_AI | _SLEEP]))
+        self.writes += 1
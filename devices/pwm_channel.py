@@ -0,0 +1,46 @@
+from machine import Pin, PWM
+
+class PwmChannel:
+    def __init__(self, pin, freq, duty=0):
+        """
+        One PWM output that remembers the duty and frequency it last wrote
+        and skips writes that would not change anything. `pin` is a pin
+        number or a Pin. writes counts the register writes actually made.
+        """
+        self.pin = pin if isinstance(pin, Pin) else Pin(pin)
+        self.pwm = PWM(self.pin, freq=freq)
+        self.freq = freq
+        self.period_us = 1000000 // freq
+        self.pwm.duty_u16(duty)
+        self.duty = duty
+        self.writes = 2
+
+    def write(self, duty):
+        """Set a 16-bit duty; returns False if it was already set"""
+        if duty == self.duty:
+            return False
+        self.pwm.duty_u16(duty)
+        self.duty = duty
+        self.writes += 1
+        return True
+
+    def write_us(self, pulse_width_us):
+        """Set the high time in microseconds, integers only"""
+        return self.write(pulse_width_us * 65535 // self.period_us)
+
+    def set_freq(self, freq):
+        """Change the frequency; returns False if it was already set"""
+        if freq == self.freq:
+            return False
+        self.pwm.freq(freq)
+        self.freq = freq
+        self.period_us = 1000000 // freq
+        self.writes += 1
+        return True
+
+    def off(self):
+        return self.write(0)
+
+    def deinit(self):
+        self.pwm.deinit()
+        self.duty = 0
@@ -0,0 +1,57 @@
+from array import array
+
+# Gray-code transition table indexed by (previous AB << 2) | current AB,
+# with A = CLK and B = DT. 0 is no movement, +-1 a valid quarter step and
+# INVALID a jump where both lines changed at once (bounce or a missed edge).
+INVALID = 2
+TRANSITIONS = array('b', [
+    0, -1, 1, INVALID,
+    1, 0, INVALID, -1,
+    -1, INVALID, 0, 1,
+    INVALID, 1, -1, 0,
+])
+
+class QuadratureDecoder:
+    def __init__(self, a_pin, b_pin, resolution=4, reverse=False):
+        """
+        Decode a quadrature encoder from its two Pin objects. Call update()
+        from an IRQ on both pins. resolution is the number of counts per
+        full Gray-code cycle: 4 counts every valid transition, 2 every other
+        one and 1 once per cycle (one detent on most knobs).
+        """
+        if resolution not in (1, 2, 4):
+            raise ValueError("resolution must be 1, 2 or 4")
+        self.a = a_pin
+        self.b = b_pin
+        self.resolution = resolution
+        self.reverse = reverse
+        self._divider = 4 // resolution
+        self._sign = -1 if reverse else 1
+        self._state = (a_pin.value() << 1) | b_pin.value()
+        self._steps = 0  # Quarter steps not yet reported
+        self.invalid = 0  # Rejected transitions
+
+    def update(self):
+        """Read both pins and return the count change: -1, 0 or 1"""
+        state = (self.a.value() << 1) | self.b.value()
+        step = TRANSITIONS[(self._state << 2) | state]
+        self._state = state
+        if step == 0:
+            return 0
+        if step == INVALID:
+            self.invalid += 1
+            return 0
+        steps = self._steps + step
+        if steps >= self._divider:
+            self._steps = steps - self._divider
+            return self._sign
+        if steps <= -self._divider:
+            self._steps = steps + self._divider
+            return -self._sign
+        self._steps = steps
+        return 0
+
+    def reset(self):
+        """Resynchronise with the pins and drop any partial step"""
+        self._state = (self.a.value() << 1) | self.b.value()
+        self._steps = 0
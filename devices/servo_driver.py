@@ -1,16 +1,20 @@
-from machine import Pin, PWM
-import asyncio
+from .pwm_channel import PwmChannel
 
-class ServoDriver:
+PERIOD_US = 20000  # 20 ms period for 50 Hz
+
+class ServoDriver(PwmChannel):
     def __init__(self, pin_number):
-        self.servo_pin = Pin(pin_number)
-        self.pwm = PWM(self.servo_pin, freq=50)  # 50 Hz frequency for servo
+        super().__init__(pin_number, 50)  # 50 Hz frequency for servo
+        
+    @staticmethod
+    def duty_for(pulse_width_us):
+        """Convert a pulse width in microseconds to a 16-bit duty, integers only"""
+        return pulse_width_us * 65535 // PERIOD_US
         
-    async def set_pulse_width(self, pulse_width_ms):
-        # Convert pulse width in ms to duty cycle for 16-bit
-        duty = int((pulse_width_ms / 20) * 65535)  # 20 ms period for 50 Hz
-        self.pwm.duty_u16(duty)
-        await asyncio.sleep_ms(1)  # Small delay for stability
+    def write_duty(self, duty):
+        """Write a precomputed duty; returns False if it was already set"""
+        return self.write(duty)
         
-    def deinit(self):
-        self.pwm.deinit() 
\ No newline at end of file
+    def set_pulse_width(self, pulse_width_ms):
+        """Set the pulse width in milliseconds; returns False if it was already set"""
+        return self.write(self.duty_for(int(pulse_width_ms * 1000)))
@@ -0,0 +1,255 @@
+from array import array
+import asyncio
+import machine
+import micropython
+import time
+
+# Track kinds
+_DUTY = 0   # target.write(duty): a PwmChannel or anything like it
+_TONE = 1   # Buzzer PwmChannel: value is a frequency, 0 is silence
+_STAGE = 2  # One channel of a ServoDisplay, committed once per frame
+
+class Timeline:
+    def __init__(self, frame_ms=20):
+        """
+        Choreography compiler. Add tracks, then describe what each does
+        over time with set(), ramp(), pulse(), fade() and tone(); times are
+        in milliseconds from the start. compile() bakes it into a Program
+        of flat arrays holding only the writes each frame needs, which a
+        TimelinePlayer pushes out from a timer without allocating.
+        Compiling allocates freely, so do it ahead of time.
+        """
+        self.frame_ms = frame_ms
+        self._targets = []
+        self._kinds = []
+        self._slots = []
+        self._levels = []
+        self._luts = []
+        self._keys = []  # Per track {frame: value}; later calls win
+
+    def _add(self, target, kind, slot=0, level=0, lut=None):
+        self._targets.append(target)
+        self._kinds.append(kind)
+        self._slots.append(slot)
+        self._levels.append(level)
+        self._luts.append(lut)
+        self._keys.append({})
+        return len(self._targets) - 1
+
+    def track(self, target, channel=None):
+        """
+        A duty track on a PwmChannel, or with `channel` on that channel of
+        a ServoDisplay (whatever its backend). Returns the track number.
+        """
+        if channel is None:
+            return self._add(target, _DUTY)
+        if not 0 <= channel < target.channels:
+            raise ValueError("no channel %d on the display" % channel)
+        return self._add(target, _STAGE, channel)
+
+    def led(self, led):
+        """Red, green and blue tracks for an RGBLedDriver, gamma baked in"""
+        lut = led.levels.lut if led.levels else None
+        return (self._add(led.pwm_red, _DUTY, lut=lut),
+                self._add(led.pwm_green, _DUTY, lut=lut),
+                self._add(led.pwm_blue, _DUTY, lut=lut))
+
+    def tone_track(self, pwm, volume=32768):
+        """A track of frequencies for a buzzer PwmChannel"""
+        return self._add(pwm, _TONE, level=volume)
+
+    def _frame(self, at_ms):
+        return at_ms // self.frame_ms
+
+    def _put(self, track, frame, value):
+        lut = self._luts[track]
+        self._keys[track][frame] = lut[value >> 8] if lut is not None else value
+
+    def set(self, track, value, at_ms=0):
+        self._put(track, self._frame(at_ms), value)
+
+    def ramp(self, track, start, end, at_ms, duration_ms):
+        """Move linearly from start to end, one value per frame"""
+        first = self._frame(at_ms)
+        last = self._frame(at_ms + duration_ms)
+        span = last - first
+        for frame in range(first, last + 1):
+            self._put(track, frame, end if not span else start + (end - start) * (frame - first) // span)
+
+    def _duty_us(self, track, pulse_width_us):
+        # PwmChannels and ServoDisplays both know their period
+        return pulse_width_us * 65535 // self._targets[track].period_us
+
+    def pulse(self, track, start_us, end_us, at_ms, duration_ms=0):
+        """Servo move between two pulse widths in microseconds"""
+        self.ramp(track, self._duty_us(track, start_us), self._duty_us(track, end_us),
+                  at_ms, duration_ms)
+
+    def fade(self, tracks, start, end, at_ms, duration_ms):
+        """Fade a (red, green, blue) track triple between 16-bit colours"""
+        for channel in range(3):
+            self.ramp(tracks[channel], start[channel], end[channel], at_ms, duration_ms)
+
+    def tone(self, track, frequency, at_ms, duration_ms):
+        """Sound frequency from at_ms for duration_ms, then go quiet"""
+        self._put(track, self._frame(at_ms), frequency)
+        end = self._frame(at_ms + duration_ms)
+        if end not in self._keys[track]:
+            self._put(track, end, 0)
+
+    def compile(self, duration_ms=0):
+        """Bake the tracks; duration_ms pads the end, e.g. for a looped hold"""
+        frames = duration_ms // self.frame_ms
+        for keys in self._keys:
+            if keys:
+                frames = max(frames, max(keys) + 1)
+        starts = array('I', [0] * (frames + 1))
+        tracks = bytearray()
+        values = array('H')
+        flush = bytearray(frames)
+        last = [None] * len(self._keys)
+        for frame in range(frames):
+            for track, keys in enumerate(self._keys):
+                value = keys.get(frame)
+                if value is None or value == last[track]:
+                    continue
+                last[track] = value
+                tracks.append(track)
+                values.append(value)
+                if self._kinds[track] == _STAGE:
+                    flush[frame] = 1
+            starts[frame + 1] = len(values)
+        displays = []
+        for track, target in enumerate(self._targets):
+            if self._kinds[track] == _STAGE and target not in displays:
+                displays.append(target)
+        return Program(self.frame_ms, frames, starts, tracks, values, flush,
+                       tuple(self._targets), bytearray(self._kinds), bytearray(self._slots),
+                       array('H', self._levels), tuple(displays))
+
+
+class Program:
+    def __init__(self, frame_ms, frames, starts, tracks, values, flush,
+                 targets, kinds, slots, levels, displays):
+        """
+        A compiled Timeline. Frame f writes values[i] to track tracks[i]
+        for i in starts[f]..starts[f + 1]; flush[f] marks frames whose
+        ServoDisplays need a commit().
+        """
+        self.frame_ms = frame_ms
+        self.frames = frames
+        self.starts = starts
+        self.tracks = tracks
+        self.values = values
+        self.flush = flush
+        self.targets = targets
+        self.kinds = kinds
+        self.slots = slots
+        self.levels = levels
+        self.displays = displays
+
+    def duration_ms(self):
+        return self.frames * self.frame_ms
+
+
+class TimelinePlayer:
+    def __init__(self, program, loop=False, timer_id=-1):
+        """
+        Play a Program from a periodic machine.Timer, one frame per tick,
+        so frame timing does not depend on what the event loop is doing.
+        The tick does not allocate; ServoDisplay commits, which may be bus
+        transactions, are scheduled out of the IRQ. max_us is the longest
+        frame so far.
+        """
+        self.program = program
+        self.loop = loop
+        self.timer_id = timer_id
+        self.timer = None
+        self.frame = 0
+        self.playing = False
+        self.frames_played = 0
+        self.max_us = 0
+        self._done = asyncio.ThreadSafeFlag()
+        self._tick_cb = self._tick  # Bound once so the IRQ doesn't allocate
+        self._commit_cb = self._commit
+        self._unsent = False  # A commit the schedule queue had no room for
+
+    def start(self):
+        """Start from the first frame, writing it straight away"""
+        self.stop()
+        self.frame = 0
+        self.playing = True
+        self._done.clear()
+        self.timer = machine.Timer(self.timer_id)
+        self.timer.init(mode=machine.Timer.PERIODIC, period=self.program.frame_ms,
+                        callback=self._tick_cb)
+        self._tick(None)
+
+    def stop(self):
+        """Stop where it is; outputs keep their last values"""
+        if self.timer is not None:
+            self.timer.deinit()
+            self.timer = None
+        if self.playing:
+            self.playing = False
+            self._done.set()
+
+    async def wait(self):
+        """Wait until a non-looping program has played to the end (or stop())"""
+        if self.playing:
+            await self._done.wait()
+
+    async def play(self):
+        self.start()
+        await self.wait()
+
+    def _commit(self, program):
+        for display in program.displays:
+            display.commit()
+
+    def _flush(self, program):
+        # Commits can mean bus transactions, so they run after the IRQ
+        try:
+            micropython.schedule(self._commit_cb, program)
+            self._unsent = False
+        except RuntimeError:
+            self._unsent = True
+
+    def _tick(self, timer):
+        started = time.ticks_us()
+        program = self.program
+        frame = self.frame
+        if frame >= program.frames:
+            if not self.loop or not program.frames:
+                if self._unsent:
+                    # The last frame's commit still has to go out
+                    self._flush(program)
+                    if self._unsent:
+                        return
+                self.stop()
+                return
+            frame = 0
+        targets = program.targets
+        kinds = program.kinds
+        tracks = program.tracks
+        values = program.values
+        for index in range(program.starts[frame], program.starts[frame + 1]):
+            track = tracks[index]
+            value = values[index]
+            kind = kinds[track]
+            if kind == _DUTY:
+                targets[track].write(value)
+            elif kind == _STAGE:
+                targets[track].frame[program.slots[track]] = value
+            elif value:
+                targets[track].set_freq(value)
+                targets[track].write(program.levels[track])
+            else:
+                targets[track].write(0)
+        if program.flush[frame] or self._unsent:
+            self._flush(program)
+        self.frame = frame + 1
+        self.frames_played += 1
+        elapsed = time.ticks_diff(time.ticks_us(), started)
+        if elapsed > self.max_us:
+            self.max_us = elapsed
@@ -1,283 +1,265 @@
 # rotary_rgb_control.py
 
-from machine import Pin, PWM
 import time
 import asyncio
-import json
+from devices.encoder_driver import EncoderDriver
+from devices.acceleration import EncoderAccelerator
+from devices.led_driver import RGBLedDriver
+from devices.gestures import PRESS, CLICK, LONG_PRESS
+from devices.color import GAMMA, ONE, mix
+from devices.buzzer_driver import BuzzerDriver, compile_melody, PRIORITY_CLICK
+from core.scheduler import Scheduler
+from core.storage import StateLog, PersistentState
+from core.events import EventBus, ROTATE, GESTURE, USER, pump_encoder
+from core import boot, metrics
+
+# Hot-path histograms and counters; print them with core.metrics.dump()
+METRICS = False
 
 # Pin definitions
-clk_pin = Pin(10, Pin.IN)
-dt_pin = Pin(11, Pin.IN)
-sw_pin = Pin(12, Pin.IN, Pin.PULL_UP)
-red_pin = PWM(Pin(2))
-green_pin = PWM(Pin(3))
-blue_pin = PWM(Pin(4))
-buzzer = PWM(Pin(1))
-buzzer.freq(440)  # Default frequency (A4 note)
-buzzer.duty_u16(0)  # Start silent
-
-# Initialize PWM frequencies
-red_pin.freq(1000)
-green_pin.freq(1000)
-blue_pin.freq(1000)
-
-# Set initial duty cycle to 0
-red_pin.duty_u16(0)
-green_pin.duty_u16(0)
-blue_pin.duty_u16(0)
-
-print("PWM pins initialized")
-
-# Initialize variables
-color_index = 0
+RED_PIN = 2
+GREEN_PIN = 3
+BLUE_PIN = 4
+BUZZER_PIN = 1
+CLK_PIN = 10
+DT_PIN = 11
+SW_PIN = 12
+
 colors = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 0), (0, 255, 255), (255, 0, 255)]
-current_color = list(colors[0])  # Track current color as a list for gradual changes
-target_color = list(colors[0])   # Track target color
-intensity = 255
-led_on = True
-mode = 'color'  # 'color' or 'dim'
-
-# Add these variables after other initializations
-last_clk_state = clk_pin.value()  # Store last state of CLK pin
-last_switch_state = sw_pin.value()  # Store last state of switch
-button_press_start = 0  # To track long press
-button_debounce_time = 0  # For debouncing
+mixed_color = bytearray(3)  # Reused by interpolate_color
+
+# Button gestures are timed by the encoder driver from its IRQs
 LONG_PRESS_TIME = 1000  # 1 second in milliseconds
-DEBOUNCE_DELAY = 50  # 50ms debounce delay
 
 # Update constants
 STEPS_PER_COLOR = 4     # Fewer steps for quicker color changes
 STEPS_PER_DIM = 20      # Keep dimming steps the same
 TRANSITION_STEPS = 10   # Faster transitions
 
-# Add these variables to track partial progress
-current_progress = 0.0  # Track progress between colors (0.0 to 1.0)
-
-# Add these variables to initialization
-last_clk_state = clk_pin.value()
-last_dt_state = dt_pin.value()
-
 # Add these constants
 ENCODER_CW = 1    # Clockwise rotation
 ENCODER_CCW = -1  # Counter-clockwise rotation
 
-# Add these variables
-encoder_value = 0      # Generic encoder position
-encoder_min = 0        # Minimum encoder value
-encoder_max = 100      # Maximum encoder value
-encoder_step = 5       # Step size for each encoder tick
-
 # Add these constants for tunes
 NOTE_C5 = 523
 NOTE_E5 = 659
 NOTE_G5 = 784
 NOTE_C6 = 1047
 
+# Tunes are compiled once; playing one never blocks the caller
+POWER_ON_TUNE = compile_melody([(NOTE_C5, 50), (0, 20), (NOTE_E5, 50), (0, 20), (NOTE_G5, 50), (0, 20)])
+POWER_OFF_TUNE = compile_melody([(NOTE_G5, 50), (0, 20), (NOTE_E5, 50), (0, 20), (NOTE_C5, 50), (0, 20)])
+TUNES = (POWER_ON_TUNE, POWER_OFF_TUNE)
+POWER_ON = 0
+POWER_OFF = 1
+
+# Input handlers only change LampState and post these; the LED, buzzer and
+# storage subscribers do the output work once per dispatch
+SHOW = USER         # The LED should show lamp.color
+TONE = USER + 1     # value: frequency << 16 | duration_ms
+TUNE = USER + 2     # value: index into TUNES
+SAVE = USER + 3     # The state changed and should be persisted
+INTENSITY = USER + 4  # value: the new intensity (0-255); posted before SHOW
+
+bus = EventBus()
+bus.coalesce(ROTATE)  # A burst of detents is one event
+bus.coalesce(SHOW)
+bus.coalesce(SAVE)
+
+class LampState:
+    def __init__(self):
+        """Everything the knob and button change; see fill_state()/load_state()"""
+        self.mode = 'color'  # 'color' or 'dim'
+        self.color_index = 0
+        self.intensity = 255
+        self.led_on = True
+        self.progress = 0  # Progress between colors (-ONE to ONE)
+        self.color = bytearray(colors[0])  # What the LED should show
+        
+    def show(self, color):
+        self.color[0] = color[0]
+        self.color[1] = color[1]
+        self.color[2] = color[2]
+        bus.post(SHOW)
+        
+    def show_current(self):
+        self.show(colors[self.color_index] if self.led_on else (0, 0, 0))
+
+lamp = LampState()
+
+# Hardware is brought up in stages by main() so the LED shows the
+# restored colour before anything else is initialised
+encoder = None
+accel = None
+led = None
+buzzer = BuzzerDriver(BUZZER_PIN, start=False)  # PWM is set up when buzzer.run() starts
+
+def init_led():
+    global led
+    # Gamma + intensity lookup table; SHOW events put lamp.color on it
+    led = RGBLedDriver(RED_PIN, GREEN_PIN, BLUE_PIN, gamma=True)
+    led.subscribe(bus, SHOW, lamp.color, intensity=INTENSITY)
+
+def init_input():
+    global encoder, accel
+    # One count per detent; the knob is wired so DT leads CLK when turning CW,
+    # and the decoder counts CLK leading as positive, hence reverse=True.
+    # No double clicks, so a click is reported as soon as the button is released
+    encoder = EncoderDriver(CLK_PIN, DT_PIN, SW_PIN, resolution=1, reverse=True,
+                            long_press_ms=LONG_PRESS_TIME, double_click_ms=0)
+    # Fast turns take bigger steps; a burst of detents is one update
+    accel = EncoderAccelerator(encoder)
+
 # Helper functions for sound
-async def beep(frequency=440, duration_ms=50):
-    """Make a short beep"""
-    buzzer.freq(frequency)
-    buzzer.duty_u16(32768)  # 50% duty cycle
-    await asyncio.sleep_ms(duration_ms)
-    buzzer.duty_u16(0)
-
-async def play_power_on():
+def beep(frequency=440, duration_ms=50):
+    """Make a short beep; cuts off any tune that is playing"""
+    bus.post(TONE, (frequency << 16) | duration_ms)
+
+def play_power_on():
     """Play power on tune (ascending)"""
-    for note in [NOTE_C5, NOTE_E5, NOTE_G5]:
-        buzzer.freq(note)
-        buzzer.duty_u16(32768)
-        await asyncio.sleep_ms(50)
-        buzzer.duty_u16(0)
-        await asyncio.sleep_ms(20)
-    
-async def play_power_off():
+    bus.post(TUNE, POWER_ON)
+
+def play_power_off():
     """Play power off tune (descending)"""
-    for note in [NOTE_G5, NOTE_E5, NOTE_C5]:
-        buzzer.freq(note)
-        buzzer.duty_u16(32768)
-        await asyncio.sleep_ms(50)
-        buzzer.duty_u16(0)
-        await asyncio.sleep_ms(20)
+    bus.post(TUNE, POWER_OFF)
 
 # Function for smooth color transition between two colors
-def interpolate_color(start_color, end_color, fraction):
-    return [int(start_color[i] + (end_color[i] - start_color[i]) * fraction) for i in range(3)]
+def interpolate_color(start_color, end_color, progress):
+    """Blend into the shared mixed_color buffer; progress runs 0-ONE"""
+    return mix(mixed_color, start_color, end_color, progress)
 
 # Function to set RGB LED color and intensity
 def set_color(r, g, b, override_intensity=None):
-    i = override_intensity if override_intensity is not None else intensity
-    r_duty = int(r * i / 255)
-    g_duty = int(g * i / 255)
-    b_duty = int(b * i / 255)
-    
-    # Convert to 16-bit values (0-65535)
-    r_duty_16 = min(65535, r_duty * 256)
-    g_duty_16 = min(65535, g_duty * 256)
-    b_duty_16 = min(65535, b_duty * 256)
-    
-    red_pin.duty_u16(r_duty_16)
-    green_pin.duty_u16(g_duty_16)
-    blue_pin.duty_u16(b_duty_16)
+    if override_intensity is not None:
+        led.pwm_red.write(GAMMA[r * override_intensity // 255])
+        led.pwm_green.write(GAMMA[g * override_intensity // 255])
+        led.pwm_blue.write(GAMMA[b * override_intensity // 255])
+        return
+        
+    # Table lookups only; the table is rebuilt when the intensity changes
+    led.set_rgb(r, g, b)
 
 # Function to handle encoder value changes
-async def on_encoder_change(direction):
-    """Handle encoder rotation events"""
-    global encoder_value, color_index, intensity, current_progress, current_color
-    
-    if not led_on:
+def on_encoder_change(steps):
+    """Apply a burst of accelerated steps (positive is CW) in one update"""
+    if not lamp.led_on:
         return
-    
-    # Now we can await the beep
-    await beep(440 if direction == ENCODER_CW else 392)
-    
-    if mode == 'color':
-        # Calculate progress step
-        step = 1.0 / STEPS_PER_COLOR
-        current_progress += (step * direction)
         
-        if direction == ENCODER_CW:
-            # Get current and next colors for interpolation
-            current_color = colors[color_index]
-            next_index = (color_index + 1) % len(colors)
-            next_color = colors[next_index]
-            
-            # Interpolate between colors based on progress
-            intermediate_color = interpolate_color(current_color, next_color, current_progress)
-            set_color(*intermediate_color)
-            print(f"CW - Color progress: {current_progress:.2f}")
-            
-            # If we've completed a full step, update the color index
-            if current_progress >= 1.0:
-                color_index = next_index
-                current_progress = 0.0
-                print(f"CW - Color changed to index: {color_index}")
-                
-        else:  # Counter-clockwise
-            # Get current and previous colors for interpolation
-            current_color = colors[color_index]
-            prev_index = (color_index - 1) % len(colors)
-            prev_color = colors[prev_index]
-            
-            # Interpolate between colors based on progress
-            intermediate_color = interpolate_color(current_color, prev_color, abs(current_progress))
-            set_color(*intermediate_color)
-            print(f"CCW - Color progress: {current_progress:.2f}")
-            
-            # If we've completed a full step backwards, update the color index
-            if current_progress <= -1.0:
-                color_index = prev_index
-                current_progress = 0.0
-                print(f"CCW - Color changed to index: {color_index}")
-            
-    elif mode == 'dim':
-        step = 255 // STEPS_PER_DIM
-        if direction == ENCODER_CW:
-            intensity = min(255, intensity + step)
-            print(f"CW - Intensity increased to: {intensity}")
-        else:
-            intensity = max(0, intensity - step)
-            print(f"CCW - Intensity decreased to: {intensity}")
-        set_color(*colors[color_index])
-
-# Modify the main control functions to be async
-async def rotary_encoder():
-    global last_clk_state, last_dt_state
+    direction = ENCODER_CW if steps > 0 else ENCODER_CCW
+    beep(440 if direction == ENCODER_CW else 392)
     
-    while True:
-        clk_state = clk_pin.value()
-        dt_state = dt_pin.value()
+    if lamp.mode == 'color':
+        # Fixed-point progress step
+        lamp.progress += ONE // STEPS_PER_COLOR * steps
         
-        if clk_state != last_clk_state:  # CLK has changed
-            if clk_state == 0:  # CLK has gone from 1 to 0
-                if last_dt_state == 1 and dt_state == 1:  # Counter-clockwise
-                    await on_encoder_change(ENCODER_CCW)
-                elif last_dt_state == 0 and dt_state == 0:  # Clockwise
-                    await on_encoder_change(ENCODER_CW)
+        # A fast spin can pass several colours at once
+        while lamp.progress >= ONE:
+            lamp.color_index = (lamp.color_index + 1) % len(colors)
+            lamp.progress -= ONE
+        while lamp.progress <= -ONE:
+            lamp.color_index = (lamp.color_index - 1) % len(colors)
+            lamp.progress += ONE
+            
+        # Interpolate towards the next colour in the direction of progress
+        next_index = (lamp.color_index + (1 if lamp.progress >= 0 else -1)) % len(colors)
+        lamp.show(interpolate_color(colors[lamp.color_index], colors[next_index], abs(lamp.progress)))
         
-        # Store states for next iteration
-        last_clk_state = clk_state
-        last_dt_state = dt_state
+    elif lamp.mode == 'dim':
+        step = 255 // STEPS_PER_DIM
+        lamp.intensity = min(255, max(0, lamp.intensity + step * steps))
+        # The LED subscriber rebuilds its table, then shows the colour
+        bus.post(INTENSITY, lamp.intensity)
+        lamp.show_current()
         
-        await asyncio.sleep_ms(1)  # Small delay for debouncing
+    bus.post(SAVE)  # Colour and intensity changes are persisted too
 
 # Add these functions for state management
-def save_state():
-    """Save current state to file"""
-    state = {
-        'mode': mode,
-        'color_index': color_index,
-        'intensity': intensity,
-        'led_on': led_on
-    }
-    try:
-        with open('led_state.json', 'w') as f:
-            json.dump(state, f)
-    except:
-        print("Could not save state")
+MODES = ('color', 'dim')
+
+def fill_state(payload):
+    """Encode the state into the 4-byte record payload"""
+    payload[0] = MODES.index(lamp.mode)
+    payload[1] = lamp.color_index
+    payload[2] = lamp.intensity
+    payload[3] = 1 if lamp.led_on else 0
+
+# Changes are written once things have been quiet for 2 s, as one small
+# record in a ring of slots instead of rewriting a JSON file
+state_log = StateLog('led_state.bin', 4)
+state_store = PersistentState(state_log, fill_state, quiet_ms=2000)
 
 def load_state():
     """Load saved state from file"""
-    global mode, color_index, intensity, led_on
-    try:
-        with open('led_state.json', 'r') as f:
-            state = json.load(f)
-            mode = state.get('mode', 'color')
-            color_index = state.get('color_index', 0)
-            intensity = state.get('intensity', 255)
-            led_on = state.get('led_on', True)
-    except:
+    payload = state_log.load()
+    if payload is None:
         print("No saved state found, using defaults")
         # Default values are already set in initialization
+        return
+    lamp.mode = MODES[payload[0]] if payload[0] < len(MODES) else 'color'
+    lamp.color_index = payload[1] % len(colors)
+    lamp.intensity = payload[2]
+    lamp.led_on = payload[3] == 1
 
-# Update the switch_press function to save state on mode changes
-async def switch_press():
-    global led_on, mode, intensity, last_switch_state, button_press_start, button_debounce_time
+# Button gestures come from the encoder driver's queue via the bus
+def on_gesture(event):
+    started = gesture_timing.start()
     
-    while True:
-        current_time = time.ticks_ms()
-        switch_state = sw_pin.value()
+    if event == PRESS:
+        print("Button press started")
+        beep(NOTE_C5, 50)
         
-        if (switch_state != last_switch_state and 
-            time.ticks_diff(current_time, button_debounce_time) >= DEBOUNCE_DELAY):
-            
-            button_debounce_time = current_time
-            
-            if switch_state == 0:  # Button pressed
-                button_press_start = current_time
-                print("Button press started")
-                await beep(NOTE_C5, 50)
-            
-            elif switch_state == 1:  # Button released
-                press_duration = time.ticks_diff(current_time, button_press_start)
-                print(f"Press duration: {press_duration}ms")
-                
-                if press_duration >= LONG_PRESS_TIME:
-                    led_on = False
-                    print("Long press detected - LED turned OFF")
-                    set_color(0, 0, 0)
-                    await play_power_off()
-                    save_state()  # Save state when turning off
-                else:
-                    if not led_on:
-                        led_on = True
-                        print("LED turned ON")
-                        set_color(*colors[color_index])
-                        await play_power_on()
-                        save_state()  # Save state when turning on
-                    else:
-                        if mode == 'color':
-                            mode = 'dim'
-                            print("Switched to DIM mode")
-                            await beep(NOTE_E5, 100)
-                        else:
-                            mode = 'color'
-                            print("Switched to COLOR mode")
-                            await beep(NOTE_G5, 100)
-                        save_state()  # Save state when changing modes
-            
-            last_switch_state = switch_state
+    elif event == LONG_PRESS:
+        # Reported while the button is still held; no click follows
+        lamp.led_on = False
+        print("Long press detected - LED turned OFF")
+        lamp.show_current()
+        play_power_off()
+        bus.post(SAVE)  # Save state when turning off
         
-        await asyncio.sleep_ms(10)
+    elif event == CLICK:
+        if not lamp.led_on:
+            lamp.led_on = True
+            print("LED turned ON")
+            lamp.show_current()
+            play_power_on()
+            bus.post(SAVE)  # Save state when turning on
+        else:
+            if lamp.mode == 'color':
+                lamp.mode = 'dim'
+                print("Switched to DIM mode")
+                beep(NOTE_E5, 100)
+            else:
+                lamp.mode = 'color'
+                print("Switched to COLOR mode")
+                beep(NOTE_G5, 100)
+            bus.post(SAVE)  # Save state when changing modes
+            
+    gesture_timing.stop(started)
+
+gesture_timing = metrics.histogram('gesture_us')  # Replaced in main() if METRICS
+
+# Output subscribers; the LED subscribes in init_led(), once it exists
+def save_state(_):
+    """Mark the state as changed; the write happens in the background"""
+    state_store.touch()
+
+bus.subscribe(ROTATE, on_encoder_change)
+bus.subscribe(GESTURE, on_gesture)
+# Queued on the sequencer, so the LED updates right away
+buzzer.subscribe(bus, tone=TONE, tune=TUNE, tunes=TUNES, priority=PRIORITY_CLICK)
+bus.subscribe(SAVE, save_state)
+
+async def dispatch_events():
+    latency = metrics.histogram('encoder.irq_to_done_us')
+    recorded_us = encoder.event_us
+    while True:
+        # Sleep until the encoder pump (or anything else) posts
+        await bus.wait()
+        # Events posted by the handlers are dispatched in the same pass and
+        # leave an empty wake behind; time each encoder IRQ only once
+        if bus.dispatch() and encoder.event_us != recorded_us:
+            recorded_us = encoder.event_us
+            latency.stop(recorded_us)
 
 async def color_transition(start_color, end_color, duration_ms=500):
     """Smooth color transition with async"""
@@ -289,34 +271,62 @@ async def color_transition(start_color, end_color, duration_ms=500):
             set_color(*end_color)
             break
             
-        fraction = elapsed / duration_ms
-        intermediate_color = interpolate_color(start_color, end_color, fraction)
-        set_color(*intermediate_color)
+        mix(mixed_color, start_color, end_color, elapsed * ONE // duration_ms)
+        set_color(mixed_color[0], mixed_color[1], mixed_color[2])
         await asyncio.sleep_ms(10)
 
 # Update the main function to load state at startup
 async def main():
-    print("Loading saved state...")
+    global gesture_timing
+    if METRICS:
+        metrics.enable()
+        gesture_timing = metrics.histogram('gesture_us')
+    boot.mark('start')
+    
+    # Critical path: LED PWM, saved state, first colour out
+    init_led()
     load_state()
-    print(f"Initial state - Mode: {mode}, LED On: {led_on}, Color Index: {color_index}, Intensity: {intensity}")
+    bus.post(INTENSITY, lamp.intensity)
+    lamp.show_current()
+    bus.dispatch()
+    boot.mark('first_frame')
+    
+    init_input()
+    boot.mark('input')
     
-    if led_on:
-        set_color(*colors[color_index])
-    else:
-        set_color(0, 0, 0)
+    # The encoder and button wake on IRQs; periodic work shares one scheduler
+    scheduler = Scheduler()
+    state_store.schedule(scheduler)
     
-    # Create tasks for encoder and button handling
-    encoder_task = asyncio.create_task(rotary_encoder())
-    button_task = asyncio.create_task(switch_press())
+    metrics.probe('encoder.irqs', lambda: encoder.irq_count)
+    metrics.probe('encoder.edges_dropped', lambda: encoder.edges_dropped)
+    metrics.probe('events.dropped', lambda: bus.dropped)
+    metrics.probe('led.writes', lambda: led.writes)
+    metrics.probe('buzzer.writes', lambda: buzzer.writes)
+    metrics.probe('state.writes', lambda: state_log.writes)
     
-    # Wait for both tasks indefinitely
-    await asyncio.gather(encoder_task, button_task)
+    # Input capture feeds the bus; dispatch does the output work
+    encoder_task = asyncio.create_task(pump_encoder(bus, encoder, accel))
+    events_task = asyncio.create_task(dispatch_events())
+    scheduler_task = asyncio.create_task(scheduler.run())
+    buzzer_task = asyncio.create_task(buzzer.run())
+    
+    # Everything below is off the critical path
+    await asyncio.sleep_ms(0)
+    boot.mark('tasks')
+    print(f"Initial state - Mode: {lamp.mode}, LED On: {lamp.led_on}, Color Index: {lamp.color_index}, Intensity: {lamp.intensity}")
+    boot.report()
+    
+    # Wait for all tasks indefinitely
+    await asyncio.gather(encoder_task, events_task, scheduler_task, buzzer_task)
 
 # Start the async event loop
-try:
-    asyncio.run(main())
-except KeyboardInterrupt:
-    print("Program terminated by user")
-finally:
-    # Clean up
-    set_color(0, 0, 0)
\ No newline at end of file
+if __name__ == '__main__':
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("Program terminated by user")
+    finally:
+        # Clean up
+        if led is not None:
+            set_color(0, 0, 0)
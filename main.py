@@ -1,9 +1,17 @@
 import asyncio
-from devices.servo_driver import ServoDriver
-from devices.led_driver import RGBLedDriver
+from machine import UART, Pin
+from devices.led_driver import RGBLedDriver, LedAnimator
 from devices.display_driver import ServoDisplay
-from devices.buzzer_driver import BuzzerDriver
+from devices.buzzer_driver import BuzzerDriver, PRIORITY_CLICK
 from devices.encoder_driver import EncoderDriver
+from devices.gestures import PRESS, NONE
+from devices.acceleration import EncoderAccelerator
+from devices.clock_face import ClockFace, DIGITS
+from core.scheduler import Scheduler
+from core.idle import IdleManager
+from core.protocol import CommandServer
+from core.storage import StateLog, PersistentState
+from core import boot, metrics
 
 # Pin definitions
 SERVO_PINS = [15, 14, 13, 12]  # Four servo pins
@@ -19,41 +27,170 @@ ENCODER_PINS = {
     'sw': 8
 }
 
-async def handle_encoder(encoder, display, buzzer, led):
-    last_count = encoder.get_counter()
+# Hot-path histograms and counters; print them with core.metrics.dump()
+METRICS = False
+
+# Idle handling: servos go limp once settled; light sleep between clock
+# ticks also stops the LED PWM on RP2, so it is off by default
+SERVO_SETTLE_MS = 500
+IDLE_MS = 30000
+LIGHTSLEEP = False
+
+# Knob -> servo: a slow detent moves SERVO_STEP_US, faster turns step
+# further (devices.acceleration), so one flick crosses the whole range
+SERVO_MIN_US = 1000
+SERVO_MAX_US = 2000
+SERVO_STEP_US = 100
+
+# Binary command channel (core.protocol) for calibration rigs and scripted
+# tests: None, 'stdin', or the number of a UART wired to COMMAND_UART_PINS.
+# On 'stdin' Ctrl-C is disabled and nothing else is printed to stdout
+COMMAND_PORT = None
+COMMAND_BAUDRATE = 115200
+COMMAND_UART_PINS = (0, 1)  # tx, rx
+
+# ClockFace calibration table; written by the command channel's SAVE
+calibration_log = StateLog('clock_cal.bin', 2 * len(SERVO_PINS) * DIGITS)
+
+def calibration_filler(clock):
+    def fill(payload):
+        table = clock.table
+        for index in range(len(table)):
+            payload[2 * index] = table[index] & 0xff
+            payload[2 * index + 1] = table[index] >> 8
+    return fill
+
+def load_calibration(clock):
+    """Put the saved calibration into clock's table; False if there is none"""
+    payload = calibration_log.load()
+    if payload is None:
+        return False
+    for index in range(len(clock.table)):
+        clock.calibrate(index // DIGITS, index % DIGITS, payload[2 * index] | (payload[2 * index + 1] << 8))
+    if clock.enabled:
+        clock.show(clock.now_ms())
+    return True
+
+def open_command_port():
+    """(reader, writer) asyncio streams for COMMAND_PORT"""
+    if COMMAND_PORT == 'stdin':
+        import micropython
+        import sys
+        # Frames are binary: a 0x03 byte must not raise KeyboardInterrupt
+        micropython.kbd_intr(-1)
+        return asyncio.StreamReader(sys.stdin.buffer), asyncio.StreamWriter(sys.stdout.buffer, {})
+    uart = UART(COMMAND_PORT, COMMAND_BAUDRATE, tx=Pin(COMMAND_UART_PINS[0]), rx=Pin(COMMAND_UART_PINS[1]))
+    return asyncio.StreamReader(uart), asyncio.StreamWriter(uart, {})
+
+async def handle_encoder(encoder, display, buzzer, led_fx, clock, idle=None):
+    latency = metrics.histogram('encoder.irq_to_done_us')
+    accel = EncoderAccelerator(encoder)
+    position_us = SERVO_MIN_US
+    recorded_us = encoder.event_us
     while True:
-        # Check encoder for position changes
-        current_count = encoder.get_counter()
-        if current_count != last_count:
-            # Use encoder position to control servo position
-            position = 1 + (current_count % 10) / 10  # Maps to 1.0-2.0 ms
-            await display.set_all_positions(position)
-            last_count = current_count
+        # Sleep until an encoder IRQ reports a turn or a press
+        await accel.wait()
+        if idle:
+            idle.input()
+        
+        # Every detent since the last pass, accelerated, in one update
+        steps = accel.read()
+        acted = steps != 0
+        if steps:
+            # Turning the knob takes the servos away from the clock
+            clock.pause()
+            
+            position_us = min(SERVO_MAX_US, max(SERVO_MIN_US, position_us + steps * SERVO_STEP_US))
+            for servo in range(display.channels):
+                display.stage_us(servo, position_us)
+            display.commit()
         
-        # Check for button press
-        if encoder.get_button_press():
-            # Create tasks for concurrent operations
-            await asyncio.gather(
-                buzzer.play_tone(440, 100),  # Play A4 note
-                led.smooth_transition((65535, 0, 0), (0, 65535, 0), 10)
-            )
+        # Drain the button gestures, or a full queue would start dropping
+        # presses; only PRESS does anything here
+        while True:
+            gesture = encoder.get_gesture()
+            if gesture == NONE:
+                break
+            if gesture != PRESS:
+                continue
+            # Pressing hands them back
+            clock.resume()
+            
+            # Fade and tone run in their own tasks; nothing here waits
+            led_fx.fade((0, 65535, 0), 1000, start=(65535, 0, 0))
+            buzzer.tone(440, 100, PRIORITY_CLICK)  # Play A4 note
+            acted = True
         
-        await asyncio.sleep_ms(10)  # Small delay to prevent busy waiting
+        # Time each IRQ once, and only when this pass acted on it
+        if acted and encoder.event_us != recorded_us:
+            recorded_us = encoder.event_us
+            latency.stop(recorded_us)
+
+async def report_boot():
+    # Runs once the other tasks have started
+    await asyncio.sleep_ms(0)
+    boot.mark('tasks')
+    # With the command channel on stdin, stdout carries its replies
+    if COMMAND_PORT != 'stdin':
+        boot.report()
 
 async def main():
     try:
-        # Initialize devices
+        if METRICS:
+            metrics.enable()
+        boot.mark('start')
+        
+        # Critical path: put the time on the servos, then the LED
         display = ServoDisplay(SERVO_PINS)
-        led = RGBLedDriver(LED_PINS['red'], LED_PINS['green'], LED_PINS['blue'])
-        buzzer = BuzzerDriver(BUZZER_PIN)
+        clock = ClockFace(display)
+        load_calibration(clock)
+        clock.tick()
+        boot.mark('display')
+        led = RGBLedDriver(LED_PINS['red'], LED_PINS['green'], LED_PINS['blue'], gamma=True)
+        led_fx = LedAnimator(led)
+        led_fx.set((0, 0, 0))
+        boot.mark('led')
+        
         encoder = EncoderDriver(
             ENCODER_PINS['clk'],
             ENCODER_PINS['dt'],
             ENCODER_PINS['sw']
         )
+        boot.mark('input')
+        
+        # Periodic work shares one scheduler task; input stays IRQ driven
+        scheduler = Scheduler()
+        clock.schedule(scheduler, priority=2)
+        led_fx.schedule(scheduler, priority=1)
+        idle = IdleManager(scheduler, SERVO_SETTLE_MS, IDLE_MS, lightsleep=LIGHTSLEEP)
+        idle.add_display(display)
+        idle.keep_awake(lambda: led_fx.active)
+        
+        # The buzzer is not needed for the first frame: its PWM comes up
+        # when its task first runs, and sounds queued before then wait
+        buzzer = BuzzerDriver(BUZZER_PIN, start=False)
+        idle.keep_awake(buzzer.playing)
+        
+        if COMMAND_PORT is not None:
+            reader, writer = open_command_port()
+            store = PersistentState(calibration_log, calibration_filler(clock), quiet_ms=0)
+            server = CommandServer(reader, writer, display=display, clock=clock, led_fx=led_fx,
+                                   buzzer=buzzer, store=store, on_load=lambda: load_calibration(clock))
+            asyncio.create_task(server.run())
+            metrics.probe('commands.frames', lambda: server.frames)
+            metrics.probe('commands.errors', lambda: server.errors)
+        
+        metrics.probe('encoder.irqs', lambda: encoder.irq_count)
+        metrics.probe('encoder.edges_dropped', lambda: encoder.edges_dropped)
+        metrics.probe('servo.writes', lambda: display.writes)
+        metrics.probe('led.writes', lambda: led.writes)
+        metrics.probe('buzzer.writes', lambda: buzzer.writes)
         
         # Create and run tasks
-        await handle_encoder(encoder, display, buzzer, led)
+        asyncio.create_task(scheduler.run())
+        asyncio.create_task(buzzer.run())
+        asyncio.create_task(report_boot())
+        await handle_encoder(encoder, display, buzzer, led_fx, clock, idle)
             
     except KeyboardInterrupt:
         # Clean shutdown
@@ -0,0 +1,179 @@
+"""
+Run the firmware on CPython against a simulated board.
+
+    import sim
+    sim.install()
+    import main
+    sim.run(main.main(), 2000, sim.quadrature(6, 7, steps=200, rate=1000))
+
+`install()` registers the stand-in `machine` and `micropython` modules,
+adds the MicroPython-only helpers (`time.ticks_ms`, `asyncio.sleep_ms`,
+`asyncio.ThreadSafeFlag`, ...)
+and makes `asyncio.run` use an event loop on a virtual clock, so sleeps
+cost no wall time and every timestamp is reproducible.
+"""
+
+import asyncio
+import sys
+import time
+
+from . import machine, micropython, uasyncio
+from .clock import VirtualClock, VirtualEventLoopPolicy, ticks_add, ticks_diff
+
+clock = machine.clock
+
+_TIME_ATTRS = ('ticks_ms', 'ticks_us', 'ticks_cpu', 'ticks_add', 'ticks_diff', 'sleep_ms', 'sleep_us')
+_ASYNCIO_ATTRS = ('sleep_ms', 'wait_for_ms', 'ThreadSafeFlag', 'StreamReader', 'StreamWriter')
+_saved = None
+
+
+def install(start_us=0, realtime=False, handler_us=0):
+    """
+    Swap in the simulated board; safe to call again to start from scratch.
+    With realtime the virtual clock is paced by the wall clock, for
+    talking to the firmware from outside the process (a pty, a socket).
+    handler_us charges every event loop callback (IRQ handler, task step,
+    timer) that much simulated time, a stand-in for the board's CPU.
+    """
+    global clock, _saved
+    if _saved is None:
+        _saved = {
+            'modules': {name: sys.modules.get(name) for name in ('machine', 'micropython')},
+            'time': {name: getattr(time, name, None) for name in _TIME_ATTRS},
+            'asyncio': {name: getattr(asyncio, name, None) for name in _ASYNCIO_ATTRS},
+            'policy': asyncio.get_event_loop_policy(),
+        }
+    clock = VirtualClock(start_us)
+    machine.reset(clock)
+    sys.modules['machine'] = machine
+    sys.modules['micropython'] = micropython
+    time.ticks_ms = clock.ticks_ms
+    time.ticks_us = clock.ticks_us
+    time.ticks_cpu = clock.ticks_cpu
+    time.ticks_add = ticks_add
+    time.ticks_diff = ticks_diff
+    time.sleep_ms = clock.sleep_ms
+    time.sleep_us = clock.sleep_us
+    for name in _ASYNCIO_ATTRS:
+        setattr(asyncio, name, getattr(uasyncio, name))
+    asyncio.set_event_loop_policy(VirtualEventLoopPolicy(clock, realtime, handler_us))
+    return clock
+
+
+def uninstall():
+    """Put back whatever `install()` replaced"""
+    global _saved
+    if _saved is None:
+        return
+    for name, module in _saved['modules'].items():
+        if module is None:
+            sys.modules.pop(name, None)
+        else:
+            sys.modules[name] = module
+    for target, attrs in ((time, _saved['time']), (asyncio, _saved['asyncio'])):
+        for name, value in attrs.items():
+            if value is None:
+                if hasattr(target, name):
+                    delattr(target, name)
+            else:
+                setattr(target, name, value)
+    asyncio.set_event_loop_policy(_saved['policy'])
+    _saved = None
+
+
+def now_us():
+    return clock.us
+
+
+def drive(pin_id, level):
+    """Put a level on an input pin right now (IRQs fire synchronously)"""
+    machine.Pin(pin_id).drive(level)
+
+
+def irq_count(pin_id):
+    """IRQ handler invocations dispatched for a pin so far"""
+    line = machine._pins.get(pin_id)
+    return line.irq_count if line else 0
+
+
+def irq_owner(pin_id):
+    """The object whose bound method handles the pin's IRQ (e.g. an EncoderDriver)"""
+    line = machine._pins.get(pin_id)
+    return getattr(line.handler, '__self__', None) if line else None
+
+
+def script(events, origin_us=None):
+    """
+    Schedule external pin levels on the running loop.
+    events: iterable of (t_us, pin_id, level), t_us relative to origin_us
+    (defaults to now).
+    """
+    loop = asyncio.get_running_loop()
+    origin = clock.us if origin_us is None else origin_us
+    for t_us, pin_id, level in events:
+        machine.expect_edge(origin + t_us, pin_id, level)
+        loop.call_at((origin + t_us) / 1e6, drive, pin_id, level)
+
+
+def quadrature(clk_pin, dt_pin, steps, rate, start_us=0, direction=1):
+    """
+    Edge script for `steps` quadrature transitions at `rate` edges/s,
+    starting from the pulled-up rest state (both pins high). Positive
+    direction is the order EncoderDriver counts up.
+    """
+    if direction > 0:
+        order = ((clk_pin, 0), (dt_pin, 0), (clk_pin, 1), (dt_pin, 1))
+    else:
+        order = ((dt_pin, 0), (clk_pin, 0), (dt_pin, 1), (clk_pin, 1))
+    period_us = 1_000_000 / rate
+    return [(start_us + int(i * period_us),) + order[i % 4] for i in range(steps)]
+
+
+def press(pin_id, at_us, hold_us, bounce=0, bounce_us=200):
+    """Edge script for an active-low button press with optional contact bounce"""
+    events = []
+    for edge_us, level in ((at_us, 0), (at_us + hold_us, 1)):
+        for i in range(bounce):
+            events.append((edge_us + i * bounce_us, level))
+            events.append((edge_us + i * bounce_us + bounce_us // 2, 1 - level))
+        events.append((edge_us + bounce * bounce_us, level))
+    return [(t, pin_id, level) for t, level in events]
+
+
+def run(coro, duration_ms, events=()):
+    """
+    Run `coro` on the virtual clock for at most duration_ms of simulated
+    time, replaying `events` (see `script`) along the way. Returns the
+    coroutine's result, or None if it was still running at the deadline.
+    """
+    async def bounded():
+        script(events)
+        task = asyncio.create_task(coro)
+        done, _ = await asyncio.wait([task], timeout=duration_ms / 1000)
+        if task in done:
+            return task.result()
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        return None
+
+    return asyncio.run(bounded())
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, len(ordered) * pct // 100)]
+
+
+def pwm_stats(duration_us):
+    """{pin_id: (duty_writes, freq_writes, duty_writes_per_second)}"""
+    stats = {}
+    for _, pin_id, kind, _ in machine.pwm_log:
+        duty, freq = stats.get(pin_id, (0, 0))
+        stats[pin_id] = (duty + 1, freq) if kind == 'duty' else (duty, freq + 1)
+    seconds = max(duration_us, 1) / 1e6
+    return {p: (d, f, d / seconds) for p, (d, f) in stats.items()}
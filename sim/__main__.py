@@ -0,0 +1,86 @@
+"""
+Run one of the entry points on the simulated board and print timing figures.
+
+    python -m sim main --seconds 5 --rate 1000
+    python -m sim encoder --rate 200 --direction -1
+"""
+
+import argparse
+import contextlib
+import importlib
+import io
+import sys
+
+import sim
+
+# module -> (clk, dt, sw, output PWM pins (servos/LED, buzzer), entry coroutine name)
+TARGETS = {
+    'main': (6, 7, 8, (15, 14, 13, 12, 5), 'main'),
+    'encoder': (10, 11, 12, (2, 3, 4, 1), 'main'),
+}
+
+
+def _fmt_us(value):
+    return '-' if value is None else '%d us' % value
+
+
+def simulate(target, seconds, rate, direction=1, verbose=False, handler_us=None):
+    """
+    Turn the knob at `rate` edges per second and report edge to answer
+    latency the way sim.replay does: only edges the firmware took count,
+    each answered by its next output write or by the firmware reading it.
+    """
+    from sim.replay import HANDLER_US, answer_latencies, script_tracked
+
+    if handler_us is None:
+        handler_us = HANDLER_US
+    clk, dt, _, outputs, entry = TARGETS[target]
+    sim.install(handler_us=handler_us)
+    sys.modules.pop(target, None)
+    out = io.StringIO()
+    with contextlib.nullcontext() if verbose else contextlib.redirect_stdout(out):
+        module = importlib.import_module(target)
+        steps = int(seconds * rate)
+        # Leave 100 ms for start-up before the knob starts turning
+        events = sim.quadrature(clk, dt, steps, rate, start_us=100_000, direction=direction)
+        accepted = []
+        consumed = {}
+        origin_us = sim.now_us()
+
+        async def firmware():
+            script_tracked(events, clk, accepted, consumed)
+            await getattr(module, entry)()
+
+        sim.run(firmware(), seconds * 1000 + 200)
+
+    duration_us = sim.now_us() - origin_us
+    latencies = answer_latencies(accepted, consumed, outputs, origin_us, handler_us)
+    irqs = sim.irq_count(clk) + sim.irq_count(dt)
+    print('target        %s' % target)
+    print('simulated     %.3f s' % (duration_us / 1e6))
+    print('edges driven  %d (%d edges/s)' % (len(events), rate))
+    print('IRQs handled  %d' % irqs)
+    print('edge->answer  p50 %s  p99 %s  max %s  (%d of %d counted edges answered)' % (
+        _fmt_us(sim.percentile(latencies, 50)),
+        _fmt_us(sim.percentile(latencies, 99)),
+        _fmt_us(max(latencies) if latencies else None),
+        len(latencies), len(accepted)))
+    for pin_id, (duty, freq, rate_hz) in sorted(sim.pwm_stats(duration_us).items()):
+        print('PWM pin %-4s  %6d duty writes (%.1f/s)  %d freq writes' % (pin_id, duty, rate_hz, freq))
+    sim.uninstall()
+
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m sim', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('target', choices=sorted(TARGETS))
+    parser.add_argument('--seconds', type=float, default=2.0)
+    parser.add_argument('--rate', type=int, default=100, help='encoder edges per second')
+    parser.add_argument('--direction', type=int, default=1, choices=(1, -1))
+    parser.add_argument('--handler-us', type=int, help='simulated time each IRQ handler or task step takes')
+    parser.add_argument('--verbose', action='store_true', help="show the firmware's own prints")
+    args = parser.parse_args(argv)
+    simulate(args.target, args.seconds, args.rate, args.direction, args.verbose, args.handler_us)
+
+
+if __name__ == '__main__':
+    cli()
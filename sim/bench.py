@@ -0,0 +1,411 @@
+"""
+Benchmark the drivers and control loops on the simulated board.
+
+    python -m sim.bench              # run, compare against the stored baseline
+    python -m sim.bench --save       # run and make the results the new baseline
+    python -m sim.bench --check      # exit non-zero on a regression or a failed check
+    python -m sim.bench spin_5k button_storm
+
+Latency is simulated time from an input edge the driver acted on to the
+next PWM write on the scenario's outputs (or to the firmware reading the
+edge out of the driver's ring, if sooner). Every IRQ handler, task step
+and timer callback is charged sim.replay.HANDLER_US, so it counts the
+callbacks on the way as well as deferral (task wake-ups, frame timing);
+it is a model of the board's CPU, not a measurement of it. Throughput is input edges per
+second of host wall time and only comparable on the same machine. Peak
+allocation is what tracemalloc saw on the host while the firmware ran
+(including the simulator's PWM log), a proxy for heap churn on the board;
+firmware_kb is what the firmware's own modules still hold at the end.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import sim
+from sim import machine
+from sim.replay import HANDLER_US, answer_latencies, script_tracked
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'bench_baseline.json')
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_FIRMWARE = [tracemalloc.Filter(True, os.path.join(ROOT, pattern))
+             for pattern in ('core/*', 'devices/*', 'main.py', 'encoder.py')]
+
+# Allowed drift before a figure counts as a regression: (relative, absolute)
+TOLERANCE = {
+    'lost': (0, 0),
+    'rejected': (0, 0),
+    'errors': (0, 0),
+    'p50_us': (0.1, 100),
+    'p99_us': (0.1, 100),
+    'pwm_writes': (0.1, 2),
+    'peak_kb': (0.2, 4),
+    'firmware_kb': (0.2, 2),
+}
+
+SCENARIOS = {}
+CHECK_ERRORS = {}  # scenario -> what its own checks found on the last run
+
+
+def scenario(name):
+    def register(func):
+        SCENARIOS[name] = func
+        return func
+    return register
+
+
+def _measure(build, events, duration_ms, outputs, clk=6, expected_counts=None, expected_presses=None,
+             errors=None):
+    """
+    Install a fresh board, let build() create the devices and return the
+    coroutine to run, replay `events` and collect the figures. Scenarios
+    that check their own results append what went wrong to `errors`.
+    Every callback costs HANDLER_US of simulated time, as in sim.replay.
+    """
+    sim.install(handler_us=HANDLER_US)
+    accepted = []
+    consumed = {}
+    holder = {}
+
+    async def firmware():
+        script_tracked(events, clk, accepted, consumed)
+        tracemalloc.start()
+        coro, encoder = build()
+        holder['encoder'] = encoder
+        if expected_presses is not None:
+            _count_presses(encoder, holder)
+        await coro
+
+    started = time.perf_counter()
+    sim.run(firmware(), duration_ms)
+    wall = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    # The PWM log keeps the duty values alive; measure without it
+    pwm_writes = len(machine.pwm_log) + sum(1 for entry in machine.i2c_log if entry[2] == 'write')
+    latencies = answer_latencies(accepted, consumed, outputs, 0, HANDLER_US) if outputs else []
+    machine.pwm_log.clear()
+    held = sum(stat.size for stat in tracemalloc.take_snapshot().filter_traces(_FIRMWARE).statistics('filename'))
+    tracemalloc.stop()
+
+    encoder = holder.get('encoder')
+    lost = 0
+    if expected_counts is not None:
+        lost += abs(expected_counts - encoder.counter)
+    if expected_presses is not None:
+        lost += abs(expected_presses - holder['presses'])
+    result = {
+        'edges': len(events),
+        'throughput': int(len(events) / wall) if events else None,
+        'p50_us': sim.percentile(latencies, 50),
+        'p99_us': sim.percentile(latencies, 99),
+        'lost': lost,
+        'rejected': encoder.decoder.invalid if encoder else 0,
+        'errors': len(errors) if errors is not None else 0,
+        'pwm_writes': pwm_writes,
+        'peak_kb': peak // 1024,
+        'firmware_kb': held // 1024,
+        'wall_ms': int(wall * 1000),
+    }
+    sim.uninstall()
+    return result
+
+
+def _count_presses(encoder, holder):
+    """Count the PRESS gestures the firmware pops, however it polls for them"""
+    from devices.gestures import PRESS
+
+    holder['presses'] = 0
+    get_gesture = encoder.get_gesture
+    get_button_press = encoder.get_button_press
+
+    def counted_gesture():
+        code = get_gesture()
+        if code == PRESS:
+            holder['presses'] += 1
+        return code
+
+    def counted_press():
+        pressed = get_button_press()
+        if pressed:
+            holder['presses'] += 1
+        return pressed
+
+    encoder.get_gesture = counted_gesture
+    encoder.get_button_press = counted_press
+
+
+def _spin(rate):
+    def build():
+        from devices.encoder_driver import EncoderDriver
+        from devices.pwm_channel import PwmChannel
+
+        encoder = EncoderDriver(6, 7, 8, resolution=4)
+        servo = PwmChannel(15, 50)
+
+        async def follow():
+            while True:
+                await encoder.wait()
+                servo.write_us(1000 + encoder.get_counter() % 100 * 10)
+
+        return follow(), encoder
+
+    events = sim.quadrature(6, 7, rate, rate, start_us=10_000)
+    return _measure(build, events, 1_100, (15,), expected_counts=rate)
+
+
+@scenario('spin_100')
+def spin_100():
+    return _spin(100)
+
+
+@scenario('spin_1k')
+def spin_1k():
+    return _spin(1_000)
+
+
+@scenario('spin_5k')
+def spin_5k():
+    return _spin(5_000)
+
+
+@scenario('button_storm')
+def button_storm():
+    """40 bouncy presses, ten a second, each answered by toggling an LED"""
+    def build():
+        from devices.encoder_driver import EncoderDriver
+        from devices.gestures import PRESS, NONE
+        from devices.pwm_channel import PwmChannel
+
+        encoder = EncoderDriver(6, 7, 8)
+        led = PwmChannel(2, 1000)
+
+        async def follow():
+            while True:
+                await encoder.wait()
+                while True:
+                    event = encoder.get_gesture()
+                    if event == NONE:
+                        break
+                    if event == PRESS:
+                        led.write(0 if led.duty else 65535)
+
+        return follow(), encoder
+
+    events = []
+    for n in range(40):
+        events += sim.press(8, 10_000 + n * 100_000, 40_000, bounce=6, bounce_us=300)
+    return _measure(build, events, 4_200, (2,), expected_presses=40)
+
+
+@scenario('led_fade_input')
+def led_fade_input():
+    """A colour cycle fades on the scheduler while a 1k edges/s spin drives a servo"""
+    colors = ((65535, 0, 0), (0, 65535, 0), (0, 0, 65535))
+
+    def build():
+        from core.scheduler import Scheduler
+        from devices.encoder_driver import EncoderDriver
+        from devices.led_driver import RGBLedDriver, LedAnimator
+        from devices.pwm_channel import PwmChannel
+
+        encoder = EncoderDriver(6, 7, 8, resolution=1)
+        servo = PwmChannel(15, 50)
+        led_fx = LedAnimator(RGBLedDriver(2, 3, 4, gamma=True))
+        scheduler = Scheduler()
+        led_fx.schedule(scheduler)
+        led_fx.cycle(colors, 300)
+
+        async def follow():
+            asyncio.create_task(scheduler.run())
+            while True:
+                await encoder.wait()
+                servo.write_us(1000 + encoder.get_counter() % 100 * 10)
+
+        return follow(), encoder
+
+    events = sim.quadrature(6, 7, 1_000, 1_000, start_us=10_000)
+    return _measure(build, events, 1_300, (15,), expected_counts=250)
+
+
+@scenario('servo_sweep')
+def servo_sweep():
+    """ServoDisplay.sweep_all over the full range and back"""
+    def build():
+        from devices.display_driver import ServoDisplay
+
+        display = ServoDisplay([15, 14, 13, 12])
+
+        async def sweep():
+            await display.sweep_all(1.0, 2.0, 0.1)
+            await display.sweep_all(2.0, 1.0, 0.1)
+
+        return sweep(), None
+
+    return _measure(build, (), 1_200, ())
+
+
+@scenario('pca9685_frames')
+def pca9685_frames():
+    """ServoDisplay on a PCA9685 at 60 Hz: 300 frames of 1-6 changed channels, then detach"""
+    from sim.pca9685 import PCA9685
+
+    errors = CHECK_ERRORS['pca9685_frames'] = []
+
+    def build():
+        from devices.display_driver import ServoDisplay
+        from devices.pca9685 import PCA9685Backend
+
+        chip = machine.attach_i2c(0x40, PCA9685())
+        display = ServoDisplay(backend=PCA9685Backend(machine.I2C(0), channels=6, freq=60))
+        # One 12-bit count, the chip's resolution
+        slack_us = display.period_us / 4096
+
+        async def frames():
+            pulses = [0] * display.channels
+            for frame in range(300):
+                # Change a different number of channels each frame, all at first
+                for channel in range(display.channels - frame % display.channels):
+                    pulses[channel] = 1000 + (frame * 37 + channel * 101) % 1001
+                    display.stage_us(channel, pulses[channel])
+                before = chip.transactions
+                written = display.commit()
+                if chip.transactions - before != (1 if written else 0):
+                    errors.append('frame %d: %d I2C transactions' % (frame, chip.transactions - before))
+                for channel in range(display.channels):
+                    if abs(chip.pulse_us(channel) - pulses[channel]) > slack_us:
+                        errors.append('frame %d channel %d: %.1f us, staged %d us' % (
+                            frame, channel, chip.pulse_us(channel), pulses[channel]))
+                await asyncio.sleep_ms(20)
+            before = chip.transactions
+            display.detach()
+            if chip.transactions - before != 1 or any(chip.pulse_us(c) for c in range(display.channels)):
+                errors.append('detach did not turn every output off in one transaction')
+
+        return frames(), None
+
+    return _measure(build, (), 6_200, (), errors=errors)
+
+
+
+@scenario('handle_encoder_session')
+def handle_encoder_session():
+    """main.handle_encoder with every device, spinning at 1k edges/s, then 12 presses"""
+    def build():
+        import main
+        from core.scheduler import Scheduler
+        from devices.buzzer_driver import BuzzerDriver
+        from devices.clock_face import ClockFace
+        from devices.display_driver import ServoDisplay
+        from devices.encoder_driver import EncoderDriver
+        from devices.led_driver import RGBLedDriver, LedAnimator
+
+        display = ServoDisplay(main.SERVO_PINS)
+        clock = ClockFace(display)
+        led_fx = LedAnimator(RGBLedDriver(2, 3, 4, gamma=True))
+        encoder = EncoderDriver(6, 7, 8)
+        scheduler = Scheduler()
+        clock.schedule(scheduler, priority=2)
+        led_fx.schedule(scheduler, priority=1)
+        buzzer = BuzzerDriver(main.BUZZER_PIN, start=False)
+
+        async def session():
+            asyncio.create_task(scheduler.run())
+            asyncio.create_task(buzzer.run())
+            await main.handle_encoder(encoder, display, buzzer, led_fx, clock)
+
+        return session(), encoder
+
+    events = sim.quadrature(6, 7, 1_000, 1_000, start_us=10_000)
+    # More presses than the gesture queue holds (three gestures each), so
+    # a loop that never drains it loses the later ones
+    for n in range(12):
+        events += sim.press(8, 1_100_000 + n * 300_000, 80_000, bounce=4)
+    return _measure(build, events, 4_800, (15, 14, 13, 12, 5, 2, 3, 4),
+                    expected_counts=500, expected_presses=12)
+
+
+def _regressions(name, result, baseline):
+    found = []
+    for key, (relative, absolute) in TOLERANCE.items():
+        old = baseline.get(key)
+        new = result.get(key)
+        if old is None or new is None:
+            continue
+        if new > old + max(absolute, old * relative):
+            found.append('%s %s: %s -> %s' % (name, key, old, new))
+    return found
+
+
+def _fmt(value):
+    return '-' if value is None else str(value)
+
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m sim.bench', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('scenarios', nargs='*', metavar='scenario', help=', '.join(SCENARIOS))
+    parser.add_argument('--save', action='store_true', help='store the results as the baseline')
+    parser.add_argument('--check', action='store_true', help='exit non-zero on a regression or a failed check')
+    parser.add_argument('--baseline', default=BASELINE)
+    args = parser.parse_args(argv)
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error('unknown scenario %r' % name)
+
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    except OSError:
+        baseline = {}
+
+    # The firmware's start-up prints would drown the table
+    names = args.scenarios or list(SCENARIOS)
+    results = {}
+    columns = ('edges', 'throughput', 'p50_us', 'p99_us', 'lost', 'rejected', 'errors', 'pwm_writes',
+               'peak_kb', 'firmware_kb', 'wall_ms')
+    print('%-24s' % 'scenario' + ''.join('%12s' % column for column in columns))
+    for name in names:
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            # The first run pays for imports and lazy set-up; keep the second
+            SCENARIOS[name]()
+            results[name] = SCENARIOS[name]()
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        print('%-24s' % name + ''.join('%12s' % _fmt(results[name][column]) for column in columns))
+        if name in baseline:
+            old = baseline[name]
+            print('%-24s' % '  baseline' + ''.join('%12s' % _fmt(old.get(column)) for column in columns))
+
+    regressions = []
+    for name, result in results.items():
+        if name in baseline:
+            regressions += _regressions(name, result, baseline[name])
+    for line in regressions:
+        print('REGRESSION', line)
+    failed = bool(regressions)
+    for name in results:
+        found = CHECK_ERRORS.get(name, ())
+        for line in found[:5]:
+            print('ERROR', name, line)
+        if len(found) > 5:
+            print('ERROR', name, '... and %d more' % (len(found) - 5))
+        failed = failed or bool(found)
+
+    if args.save:
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print('saved', args.baseline)
+    if args.check and failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    cli()
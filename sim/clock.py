@@ -0,0 +1,142 @@
+import asyncio
+import collections
+import math
+import selectors
+import time
+
+# MicroPython ports wrap ticks_ms()/ticks_us() at 2**30
+TICKS_PERIOD = 1 << 30
+TICKS_MAX = TICKS_PERIOD - 1
+TICKS_HALFPERIOD = TICKS_PERIOD // 2
+
+
+class VirtualClock:
+    """Monotonic microsecond clock that only moves when the simulation says so"""
+
+    def __init__(self, start_us=0):
+        self.us = start_us
+
+    def advance_us(self, us):
+        if us > 0:
+            self.us += us
+
+    def advance_to_us(self, us):
+        if us > self.us:
+            self.us = us
+
+    # MicroPython `time` module API
+    def ticks_ms(self):
+        return (self.us // 1000) & TICKS_MAX
+
+    def ticks_us(self):
+        return self.us & TICKS_MAX
+
+    def ticks_cpu(self):
+        return self.us & TICKS_MAX
+
+    def sleep_ms(self, ms):
+        """Blocking sleep: time passes but nothing else gets to run"""
+        self.advance_us(int(ms * 1000))
+
+    def sleep_us(self, us):
+        self.advance_us(int(us))
+
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) & TICKS_MAX
+
+
+def ticks_diff(ticks1, ticks2):
+    return ((ticks1 - ticks2 + TICKS_HALFPERIOD) & TICKS_MAX) - TICKS_HALFPERIOD
+
+
+class VirtualSelector(selectors.BaseSelector):
+    """
+    Selector that turns every wait into a jump of the virtual clock.
+    Real file descriptors (the loop's self-pipe, a pty, a socket) are still
+    polled without blocking so host-side I/O keeps working. In realtime
+    mode waits really take place, so outside processes can keep up.
+    """
+
+    def __init__(self, clock, realtime=False):
+        self.clock = clock
+        self.realtime = realtime
+        self._real = selectors.DefaultSelector()
+
+    def register(self, fileobj, events, data=None):
+        return self._real.register(fileobj, events, data)
+
+    def unregister(self, fileobj):
+        return self._real.unregister(fileobj)
+
+    def modify(self, fileobj, events, data=None):
+        return self._real.modify(fileobj, events, data)
+
+    def get_key(self, fileobj):
+        return self._real.get_key(fileobj)
+
+    def get_map(self):
+        return self._real.get_map()
+
+    def close(self):
+        self._real.close()
+
+    def select(self, timeout=None):
+        if self.realtime and timeout != 0:
+            started = time.monotonic()
+            ready = self._real.select(timeout)
+            if ready or timeout is None:
+                self.clock.advance_us(int((time.monotonic() - started) * 1e6))
+                return ready
+            self.clock.advance_us(math.ceil(timeout * 1e6 - 1e-3))
+            return ready
+        ready = self._real.select(0)
+        if ready or timeout == 0:
+            return ready
+        if timeout is None:
+            # Nothing is scheduled in virtual time; only real I/O can wake us
+            return self._real.select(None)
+        # Round up so the earliest timer is due once the loop looks again
+        self.clock.advance_us(math.ceil(timeout * 1e6 - 1e-3))
+        return []
+
+
+class ChargedQueue(collections.deque):
+    """The loop's ready queue: taking a callback off it costs handler_us"""
+
+    def __init__(self, clock, handler_us):
+        super().__init__()
+        self.clock = clock
+        self.handler_us = handler_us
+
+    def popleft(self):
+        self.clock.advance_us(self.handler_us)
+        return super().popleft()
+
+
+class VirtualEventLoop(asyncio.SelectorEventLoop):
+    """
+    Event loop on the virtual clock. Callbacks (task steps, IRQ handlers,
+    timers) take no simulated time unless handler_us is given, in which
+    case each one moves the clock on by that much before it runs.
+    """
+
+    def __init__(self, clock, realtime=False, handler_us=0):
+        self.clock = clock
+        super().__init__(VirtualSelector(clock, realtime))
+        if handler_us:
+            self._ready = ChargedQueue(clock, handler_us)
+
+    def time(self):
+        return self.clock.us / 1e6
+
+
+class VirtualEventLoopPolicy(asyncio.DefaultEventLoopPolicy):
+    def __init__(self, clock, realtime=False, handler_us=0):
+        super().__init__()
+        self.clock = clock
+        self.realtime = realtime
+        self.handler_us = handler_us
+
+    def new_event_loop(self):
+        return VirtualEventLoop(self.clock, self.realtime, self.handler_us)
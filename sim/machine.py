@@ -0,0 +1,375 @@
+"""
+Host-side stand-in for the MicroPython `machine` module.
+
+Pins keep a shared level per pin id, so `Pin(10)` created in two modules
+talks to the same line. External levels are driven by the simulation
+(`Pin.drive` or `sim.script`); IRQ handlers run synchronously the moment
+the level changes, like a hard IRQ on the board. Every PWM write is logged
+with its virtual timestamp. I2C peripherals are host-side models attached
+to an address with `attach_i2c`; every transaction on the bus is logged.
+A UART is connected to a host file descriptor (a pty) with `attach_uart`.
+"""
+
+import asyncio
+import errno
+import heapq
+import os
+import select
+
+from .clock import VirtualClock
+
+clock = VirtualClock()
+
+# Every PWM write as (t_us, pin_id, kind, value); kind is 'duty' or 'freq'
+pwm_log = []
+
+# Every lightsleep() as (t_us, requested_ms, slept_us)
+sleep_log = []
+
+# (t_us, pin_id, level) the simulation has scheduled for input pins;
+# lightsleep() wakes up for them the way a pin IRQ wakes the board
+_pin_events = []
+
+# Every I2C transaction as (t_us, address, kind, data); kind is 'write' or 'read'
+i2c_log = []
+
+_pins = {}
+_i2c_devices = {}
+_uarts = {}
+
+
+def reset(new_clock=None):
+    """Forget all pin and PWM state, optionally switching to another clock"""
+    global clock
+    if new_clock is not None:
+        clock = new_clock
+    _pins.clear()
+    pwm_log.clear()
+    sleep_log.clear()
+    _pin_events.clear()
+    i2c_log.clear()
+    _i2c_devices.clear()
+    _uarts.clear()
+
+
+def freq(hz=None):
+    return 125_000_000
+
+
+def unique_id():
+    return b'\x00reloj\x00\x00'
+
+
+def expect_edge(t_us, pin_id, level):
+    """Tell lightsleep() that an input pin will be driven at clock time t_us"""
+    heapq.heappush(_pin_events, (t_us, pin_id, level))
+
+
+def lightsleep(time_ms=None):
+    """
+    Block the whole board until time_ms passes or an input pin changes. A
+    pin change ends the sleep with its IRQ already run, as on the board;
+    the event loop's own later drive() of that level is then a no-op.
+    """
+    start = clock.us
+    while _pin_events and _pin_events[0][0] < start:
+        heapq.heappop(_pin_events)
+    end = start + time_ms * 1000 if time_ms is not None else None
+    if _pin_events and (end is None or _pin_events[0][0] < end):
+        end, pin_id, level = heapq.heappop(_pin_events)
+        clock.advance_to_us(end)
+        Pin(pin_id).drive(level)
+    elif end is None:
+        raise RuntimeError('lightsleep() with nothing to wake the board')
+    else:
+        clock.advance_to_us(end)
+    sleep_log.append((start, time_ms, end - start))
+
+
+class _Line:
+    """State shared by every Pin object created for one pin id"""
+
+    def __init__(self, pin_id):
+        self.id = pin_id
+        self.mode = Pin.IN
+        self.pull = None
+        self.out = 0
+        self.external = None
+        self.handler = None
+        self.trigger = 0
+        self.owner = None
+        self.irq_count = 0
+        self.edges = 0
+
+    def level(self):
+        if self.mode == Pin.OUT:
+            return self.out
+        if self.external is not None:
+            return self.external
+        return 1 if self.pull == Pin.PULL_UP else 0
+
+    def settle(self, before):
+        after = self.level()
+        if after == before:
+            return
+        self.edges += 1
+        if self.handler is None:
+            return
+        if after and self.trigger & Pin.IRQ_RISING or not after and self.trigger & Pin.IRQ_FALLING:
+            self.irq_count += 1
+            self.handler(self.owner)
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    ALT = 3
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    def __init__(self, pin_id, mode=-1, pull=-1, value=None):
+        line = _pins.get(pin_id)
+        if line is None:
+            line = _pins[pin_id] = _Line(pin_id)
+        self._line = line
+        self.init(mode, pull, value)
+
+    def init(self, mode=-1, pull=-1, value=None):
+        line = self._line
+        before = line.level()
+        if mode != -1:
+            line.mode = mode
+        if pull != -1:
+            line.pull = pull
+        if value is not None:
+            line.out = 1 if value else 0
+        line.settle(before)
+
+    def value(self, x=None):
+        line = self._line
+        if x is None:
+            return line.level()
+        before = line.level()
+        line.out = 1 if x else 0
+        line.settle(before)
+
+    __call__ = value
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING, hard=False):
+        line = self._line
+        line.handler = handler
+        line.trigger = trigger
+        line.owner = self
+
+    def drive(self, level):
+        """Set the level an external device puts on the pin (None releases it)"""
+        line = self._line
+        before = line.level()
+        line.external = level
+        line.settle(before)
+
+    @property
+    def id(self):
+        return self._line.id
+
+    def __repr__(self):
+        return 'Pin(%s)' % (self._line.id,)
+
+
+class PWM:
+    def __init__(self, dest, freq=None, duty_u16=None, duty_ns=None):
+        self.pin = dest if isinstance(dest, Pin) else Pin(dest)
+        self._freq = 1000
+        self._duty = 0
+        self.active = True
+        if freq is not None:
+            self.freq(freq)
+        if duty_u16 is not None:
+            self.duty_u16(duty_u16)
+        if duty_ns is not None:
+            self.duty_ns(duty_ns)
+
+    def _log(self, kind, value):
+        pwm_log.append((clock.us, self.pin.id, kind, value))
+
+    def freq(self, value=None):
+        if value is None:
+            return self._freq
+        if not 8 <= value <= 62_500_000:
+            raise ValueError('freq out of range')
+        self._freq = int(value)
+        self._log('freq', self._freq)
+
+    def duty_u16(self, value=None):
+        if value is None:
+            return self._duty
+        if not 0 <= value <= 65535:
+            raise ValueError('duty out of range')
+        self._duty = int(value)
+        self._log('duty', self._duty)
+
+    def duty_ns(self, value=None):
+        period_ns = 1_000_000_000 // self._freq
+        if value is None:
+            return self._duty * period_ns // 65535
+        self.duty_u16(min(65535, value * 65535 // period_ns))
+
+    def deinit(self):
+        self.active = False
+        self._duty = 0
+        self._log('duty', 0)
+
+
+class Timer:
+    """
+    Virtual timer. Callbacks are run by the event loop at their virtual
+    deadline, so the loop has to be running (as it is under `sim.run`).
+    """
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, id=-1, **kwargs):
+        self._handle = None
+        if kwargs:
+            self.init(**kwargs)
+
+    def init(self, mode=PERIODIC, freq=-1, period=-1, callback=None, tick_hz=1000):
+        self.deinit()
+        if freq > 0:
+            self._period_s = 1 / freq
+        else:
+            self._period_s = max(period, 0) / tick_hz
+        self._mode = mode
+        self._callback = callback
+        self._handle = asyncio.get_event_loop().call_later(self._period_s, self._fire)
+
+    def _fire(self):
+        if self._mode == Timer.PERIODIC:
+            self._handle = asyncio.get_event_loop().call_later(self._period_s, self._fire)
+        else:
+            self._handle = None
+        if self._callback is not None:
+            self._callback(self)
+
+    def deinit(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+
+def attach_i2c(address, device):
+    """
+    Put a device model on the bus. It needs write(data), called with each
+    write transaction's bytes (register pointer first), and read(nbytes).
+    """
+    _i2c_devices[address] = device
+    return device
+
+
+class I2C:
+    """Every bus (and SoftI2C) sees the same attached devices"""
+
+    def __init__(self, id=0, scl=None, sda=None, freq=400_000, timeout=50_000):
+        self.id = id
+        self._freq = freq
+
+    def init(self, scl=None, sda=None, freq=400_000, timeout=50_000):
+        self._freq = freq
+
+    def _device(self, addr):
+        device = _i2c_devices.get(addr)
+        if device is None:
+            # What the board raises when nothing acknowledges the address
+            raise OSError(errno.ENODEV, 'ENODEV')
+        return device
+
+    def scan(self):
+        return sorted(_i2c_devices)
+
+    def writeto(self, addr, buf, stop=True):
+        data = bytes(buf)
+        self._device(addr).write(data)
+        i2c_log.append((clock.us, addr, 'write', data))
+        return len(data)
+
+    def readfrom(self, addr, nbytes, stop=True):
+        data = bytes(self._device(addr).read(nbytes))
+        i2c_log.append((clock.us, addr, 'read', data))
+        return data
+
+    def readfrom_into(self, addr, buf, stop=True):
+        buf[:] = self.readfrom(addr, len(buf))
+
+    def writeto_mem(self, addr, memaddr, buf, addrsize=8):
+        self.writeto(addr, bytes([memaddr]) + bytes(buf))
+
+    def readfrom_mem(self, addr, memaddr, nbytes, addrsize=8):
+        self._device(addr).write(bytes([memaddr]))
+        return self.readfrom(addr, nbytes)
+
+    def readfrom_mem_into(self, addr, memaddr, buf, addrsize=8):
+        buf[:] = self.readfrom_mem(addr, memaddr, len(buf))
+
+
+SoftI2C = I2C
+
+
+def attach_uart(uart_id, fd):
+    """Connect UART uart_id to a host file descriptor, e.g. a pty's slave end"""
+    _uarts[uart_id] = fd
+
+
+class UART:
+    """Non-blocking, like the board's: read() returns None when nothing is waiting"""
+
+    def __init__(self, id, baudrate=115200, bits=8, parity=None, stop=1, tx=None, rx=None, **kwargs):
+        self.id = id
+        self.baudrate = baudrate
+        fd = _uarts.get(id)
+        if fd is None:
+            # Nothing connected: a line that never receives anything
+            fd, self._unused = os.pipe()
+        os.set_blocking(fd, False)
+        self._fd = fd
+
+    def fileno(self):
+        return self._fd
+
+    def read(self, nbytes=None):
+        try:
+            return os.read(self._fd, nbytes or 4096) or None
+        except (BlockingIOError, OSError):
+            return None
+
+    def readinto(self, buf, nbytes=None):
+        data = self.read(nbytes or len(buf))
+        if not data:
+            return None
+        buf[:len(data)] = data
+        return len(data)
+
+    def any(self):
+        return 1 if select.select([self._fd], [], [], 0)[0] else 0
+
+    def write(self, buf):
+        try:
+            return os.write(self._fd, bytes(buf))
+        except BlockingIOError:
+            return 0
+
+    def deinit(self):
+        pass
+
+
+def pwm_writes(pin_id, kind='duty'):
+    """[(t_us, value), ...] for one pin"""
+    return [(t, v) for t, p, k, v in pwm_log if p == pin_id and k == kind]
@@ -0,0 +1,36 @@
+"""Host-side stand-in for the MicroPython `micropython` module"""
+
+import asyncio
+
+
+def const(value):
+    return value
+
+
+def native(func):
+    return func
+
+
+viper = native
+
+
+def alloc_emergency_exception_buf(size):
+    pass
+
+
+def schedule(func, arg):
+    """Run func(arg) soon from the main loop, like a soft IRQ"""
+    asyncio.get_event_loop().call_soon(func, arg)
+
+
+def kbd_intr(chr):
+    """Ctrl-C handling belongs to the host terminal here"""
+    pass
+
+
+def heap_lock():
+    return 0
+
+
+def heap_unlock():
+    return 0
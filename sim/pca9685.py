@@ -0,0 +1,101 @@
+"""
+Register-level model of a PCA9685 PWM controller for the simulated I2C bus.
+
+    from sim import machine
+    from sim.pca9685 import PCA9685
+    chip = machine.attach_i2c(0x40, PCA9685())
+    ...
+    chip.pulse_us(0)
+
+It keeps the 256-byte register file and applies the parts of the datasheet
+the driver depends on: auto-increment (MODE1.AI), the ALL_LED broadcast
+registers, the prescaler only being writable while MODE1.SLEEP is set, and
+the full-on/full-off bits. Outputs are dark while the chip sleeps.
+"""
+
+MODE1 = 0x00
+MODE2 = 0x01
+LED0_ON_L = 0x06
+ALL_LED_ON_L = 0xFA
+PRESCALE = 0xFE
+
+RESTART = 0x80
+AI = 0x20
+SLEEP = 0x10
+FULL = 0x10  # Bit 4 of LEDn_ON_H / LEDn_OFF_H
+
+OSC_HZ = 25_000_000
+CHANNELS = 16
+
+
+class PCA9685:
+    def __init__(self):
+        self.regs = bytearray(256)
+        # Power-on state: asleep, all outputs full off, 200 Hz
+        self.regs[MODE1] = SLEEP
+        self.regs[MODE2] = 0x04
+        self.regs[PRESCALE] = 0x1E
+        for channel in range(CHANNELS):
+            self.regs[LED0_ON_L + 4 * channel + 3] = FULL
+        self.pointer = 0
+        self.transactions = 0
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.transactions += 1
+        if not data:
+            return
+        self.pointer = data[0]
+        for value in data[1:]:
+            self._store(self.pointer, value)
+            self.bytes_written += 1
+            if self.regs[MODE1] & AI:
+                self.pointer = (self.pointer + 1) & 0xff
+
+    def read(self, nbytes):
+        self.transactions += 1
+        out = bytearray()
+        for _ in range(nbytes):
+            out.append(self.regs[self.pointer])
+            if self.regs[MODE1] & AI:
+                self.pointer = (self.pointer + 1) & 0xff
+        return bytes(out)
+
+    def _store(self, reg, value):
+        if reg == PRESCALE:
+            if self.regs[MODE1] & SLEEP:
+                self.regs[reg] = max(value, 3)
+        elif reg == MODE1:
+            # Writing RESTART clears it; it never reads back as set
+            self.regs[reg] = value & ~RESTART
+        elif ALL_LED_ON_L <= reg < ALL_LED_ON_L + 4:
+            for channel in range(CHANNELS):
+                self.regs[LED0_ON_L + 4 * channel + reg - ALL_LED_ON_L] = value
+        else:
+            self.regs[reg] = value
+
+    def freq(self):
+        return OSC_HZ / (4096 * (self.regs[PRESCALE] + 1))
+
+    def asleep(self):
+        return bool(self.regs[MODE1] & SLEEP)
+
+    def counts(self, channel):
+        """(on, off) counts out of 4096; full-off wins over full-on"""
+        base = LED0_ON_L + 4 * channel
+        regs = self.regs
+        if regs[base + 3] & FULL:
+            return 0, 0
+        if regs[base + 1] & FULL:
+            return 0, 4096
+        on = regs[base] | (regs[base + 1] & 0x0f) << 8
+        off = regs[base + 2] | (regs[base + 3] & 0x0f) << 8
+        return on, off
+
+    def pulse_us(self, channel):
+        """High time per period on an output, 0 while off or asleep"""
+        if self.asleep():
+            return 0
+        on, off = self.counts(channel)
+        high = 4096 if off == 4096 else (off - on) % 4096
+        return high * 1e6 / self.freq() / 4096
@@ -0,0 +1,200 @@
+"""
+Drive the firmware over its binary command protocol (core.protocol).
+
+    python -m sim.remote                          # simulated board on a pty
+    python -m sim.remote --frames 2000
+    python -m sim.remote --device /dev/ttyACM0    # a board with COMMAND_PORT set
+
+Without --device, main.py runs on the simulated board in a background
+thread, paced by the wall clock, with its command UART on one end of a
+pseudo-terminal. The session talks to the other end exactly as it would
+to a serial port: ping, colour, palette, melody, a stream of servo frames
+sent without waiting for replies, then metrics. It exits non-zero if any
+command fails.
+"""
+
+import argparse
+import os
+import pty
+import struct
+import sys
+import threading
+import time
+import tty
+
+from core import protocol
+
+STATUS = {protocol.OK: 'ok', protocol.BAD_CRC: 'bad crc', protocol.UNKNOWN: 'unknown command',
+          protocol.BAD_LENGTH: 'bad length', protocol.UNSUPPORTED: 'unsupported',
+          protocol.FAILED: 'failed'}
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class Client:
+    """Host end of the protocol over a file descriptor (serial port or pty)"""
+
+    def __init__(self, fd, timeout=2.0):
+        self.fd = fd
+        self.timeout = timeout
+        self.sequence = 0
+        self._out = bytearray(protocol.HEADER_SIZE + protocol.MAX_PAYLOAD + protocol.CRC_SIZE)
+        self._in = b''
+
+    def send(self, command, payload=b'', quiet=False):
+        """Write one frame; returns its sequence number"""
+        self.sequence = (self.sequence + 1) & 0xff
+        length = protocol.encode(self._out, command | (protocol.QUIET if quiet else 0),
+                                 self.sequence, payload)
+        os.write(self.fd, self._out[:length])
+        return self.sequence
+
+    def _read(self, n):
+        deadline = time.monotonic() + self.timeout
+        while len(self._in) < n:
+            if time.monotonic() > deadline:
+                raise ProtocolError('timed out waiting for a reply')
+            try:
+                self._in += os.read(self.fd, 4096)
+            except BlockingIOError:
+                time.sleep(0.001)
+        data, self._in = self._in[:n], self._in[n:]
+        return data
+
+    def receive(self):
+        """Next reply frame as (command, sequence, status, data)"""
+        while self._read(1) != protocol.SYNC[:1] or self._read(1) != protocol.SYNC[1:]:
+            pass
+        header = self._read(4)
+        command, sequence, length = struct.unpack('<BBH', header)
+        body = self._read(length + protocol.CRC_SIZE)
+        crc = protocol.crc16(header + body[:length])
+        if crc != struct.unpack_from('<H', body, length)[0]:
+            raise ProtocolError('reply with a bad CRC')
+        return command & ~protocol.REPLY, sequence, body[0], body[1:length]
+
+    def call(self, command, payload=b''):
+        """Send and wait for the answer; returns its data, raises on a bad status"""
+        sequence = self.send(command, payload)
+        while True:
+            answered, got, status, data = self.receive()
+            if got == sequence:
+                break
+        if status != protocol.OK:
+            raise ProtocolError('command 0x%02x: %s' % (command, STATUS.get(status, status)))
+        return data
+
+    def ping(self):
+        self.call(protocol.PING)
+
+    def servo_frame(self, pulses_us, first=0, quiet=False):
+        payload = struct.pack('<B%dH' % len(pulses_us), first, *pulses_us)
+        if quiet:
+            self.send(protocol.SERVO_FRAME, payload, quiet=True)
+        else:
+            self.call(protocol.SERVO_FRAME, payload)
+
+    def calibrate(self, servo, digit, pulse_us):
+        self.call(protocol.CALIBRATE, struct.pack('<BBH', servo, digit, pulse_us))
+
+    def color(self, red, green, blue):
+        self.call(protocol.COLOR, struct.pack('<3H', red, green, blue))
+
+    def palette(self, colors, segment_ms):
+        flat = [level for color in colors for level in color]
+        self.call(protocol.PALETTE, struct.pack('<H%dH' % len(flat), segment_ms, *flat))
+
+    def melody(self, notes, priority=0):
+        flat = [value for note in notes for value in note]
+        self.call(protocol.MELODY, struct.pack('<B%dH' % len(flat), priority, *flat))
+
+    def metrics(self):
+        data = self.call(protocol.METRICS)
+        values = {}
+        pos = 0
+        while pos < len(data):
+            size = data[pos]
+            name = data[pos + 1:pos + 1 + size].decode()
+            values[name] = struct.unpack_from('<i', data, pos + 1 + size)[0]
+            pos += 1 + size + 4
+        return values
+
+    def save(self):
+        self.call(protocol.SAVE)
+
+    def load(self):
+        self.call(protocol.LOAD)
+
+
+def start_simulated():
+    """Run main.py on the simulated board with UART 0 on a pty; returns the host fd"""
+    import sim
+    from sim import machine
+
+    host, board = pty.openpty()
+    tty.setraw(host)
+    tty.setraw(board)
+    os.set_blocking(host, False)
+    sim.install(realtime=True)
+    machine.attach_uart(0, board)
+    import main
+    main.COMMAND_PORT = 0
+    main.METRICS = True
+    thread = threading.Thread(target=sim.run, args=(main.main(), 24 * 3600 * 1000), daemon=True)
+    thread.start()
+    return host
+
+
+def session(client, frames):
+    client.ping()
+    print('ping          ok')
+    client.color(65535, 0, 0)
+    client.palette(((65535, 0, 0), (0, 65535, 0), (0, 0, 65535)), 200)
+    print('colour        ok (red, then a three colour cycle)')
+    client.melody(((523, 50), (0, 20), (659, 50), (0, 20), (784, 50)))
+    print('melody        ok')
+
+    started = time.monotonic()
+    for n in range(frames):
+        pulse = 1000 + n % 1000
+        client.servo_frame((pulse, pulse + 1, pulse + 2, pulse + 3), quiet=True)
+    client.ping()  # Answered once every frame before it has been handled
+    elapsed = time.monotonic() - started
+    print('servo frames  %d in %.3f s (%d frames/s, no replies)' % (frames, elapsed, frames / elapsed))
+
+    values = client.metrics()
+    print('metrics       %d values: %s' % (len(values), ', '.join(
+        '%s=%d' % item for item in sorted(values.items()) if item[0].startswith(('commands', 'servo')))))
+    return (frames - 1) % 1000 + 1000
+
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m sim.remote', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--device', help='serial device of a real board instead of the simulator')
+    parser.add_argument('--frames', type=int, default=500, help='servo frames to stream')
+    args = parser.parse_args(argv)
+
+    if args.device:
+        fd = os.open(args.device, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        tty.setraw(fd)
+    else:
+        fd = start_simulated()
+    client = Client(fd)
+    try:
+        last = session(client, args.frames)
+    except ProtocolError as e:
+        print('FAIL', e)
+        sys.exit(1)
+    if not args.device:
+        from sim import machine
+        duty = machine.pwm_writes(15)[-1][1]
+        expected = last * 65535 // 20000
+        print('servo pin 15  duty %d, expected %d: %s' % (duty, expected, 'ok' if duty == expected else 'FAIL'))
+        if duty != expected:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,247 @@
+"""
+Replay recorded encoder traces (core.trace) through the firmware on the
+simulated board and check what it made of them.
+
+    python -m sim.replay traces/*.rtr --target main --speed 2
+    python -m sim.replay --make-corpus traces
+
+Each replay reports the count the decoder ended on against the count the
+trace says it should, edges the decoder rejected, IRQ ring overflows and
+the time from each input edge to its answer: the next PWM write, or the
+firmware taking the edge out of the driver's ring when that comes first
+(an edge that moves nothing, e.g. with the output at its limit, is
+answered by being read). Every IRQ handler, task step and timer callback
+is charged --handler-us of simulated time, so latency is the handlers on
+the way to the answer plus any scheduling deferral (sleeps, frames); with
+--handler-us 0 the virtual clock stands still and IRQ-driven firmware
+answers at 0 us. With --check the exit status is non-zero when a count is
+off or p99 latency exceeds --max-p99-us.
+"""
+
+import argparse
+import asyncio
+import bisect
+import collections
+import contextlib
+import importlib
+import io
+import sys
+
+import sim
+from sim.__main__ import TARGETS
+
+# Simulated time per event loop callback; with none the virtual clock
+# stands still while the firmware runs and every answer comes at 0 us
+HANDLER_US = 100
+MAX_P99_US = 5_000  # A frame or poll of a few ms on the way trips it
+
+
+def trace_events(trace, clk, dt, sw, speed=1.0, start_us=0):
+    """Pin level script for a trace: one event per line that changed"""
+    from core.trace import CLK, DT, SW
+
+    events = []
+    previous = trace.initial
+    for index in range(trace.count):
+        t_us = start_us + int(trace.offsets[index] / speed)
+        state = trace.states[index]
+        changed = state ^ previous
+        for bit, pin_id in ((CLK, clk), (DT, dt), (SW, sw)):
+            if changed & bit:
+                events.append((t_us, pin_id, 1 if state & bit else 0))
+        previous = state
+    return events
+
+
+def _watch_reads(encoder, pending, consumed, origin):
+    """Note when the firmware takes each ringed edge out of the driver"""
+    read = encoder.read_edges
+
+    def read_edges(ticks_buf, delta_buf):
+        count = read(ticks_buf, delta_buf)
+        for _ in range(count):
+            if pending:
+                consumed[pending.popleft()] = sim.now_us() - origin
+        return count
+
+    encoder.read_edges = read_edges
+
+
+def script_tracked(events, clk, accepted, consumed=None):
+    """
+    Like sim.script, but notes in `accepted` every edge the firmware is
+    expected to answer: ones that moved the count or started a press.
+    With a `consumed` dict, {index in accepted: t_us} also records when
+    the firmware read each counted edge back out of the encoder's ring.
+    """
+    loop = asyncio.get_running_loop()
+    origin = sim.now_us()
+    pending = collections.deque()
+    watched = []
+
+    def edge(t_us, pin_id, level):
+        encoder = sim.irq_owner(clk)
+        if encoder is None:
+            sim.drive(pin_id, level)
+            return
+        if consumed is not None and encoder not in watched:
+            watched.append(encoder)
+            _watch_reads(encoder, pending, consumed, origin)
+        counter = encoder.counter
+        dropped = encoder.edges_dropped
+        pressed = encoder.gestures.pressed if encoder.gestures else False
+        sim.drive(pin_id, level)
+        if encoder.counter != counter or (encoder.gestures and encoder.gestures.pressed and not pressed):
+            if encoder.counter != counter and encoder.edges_dropped == dropped:
+                pending.append(len(accepted))
+            # When the edge happened, not when its IRQ got to run
+            accepted.append((t_us, pin_id, level))
+
+    for t_us, pin_id, level in events:
+        sim.machine.expect_edge(origin + t_us, pin_id, level)
+        loop.call_at((origin + t_us) / 1e6, edge, t_us, pin_id, level)
+
+
+def answer_latencies(accepted, consumed, pwm_pins, origin_us=0, handler_us=0):
+    """
+    Time from each accepted edge to the first PWM duty write on `pwm_pins`
+    at least handler_us after it (its IRQ has to run first), or to when it
+    was consumed if that is sooner. Edges with neither are left out.
+    """
+    pins = set(pwm_pins)
+    writes = [t for t, p, kind, _ in sim.machine.pwm_log if p in pins and kind == 'duty']
+    latencies = []
+    for index, (t_us, _, _) in enumerate(accepted):
+        t = origin_us + t_us
+        answers = []
+        j = bisect.bisect_left(writes, t + handler_us)
+        if j < len(writes):
+            answers.append(writes[j] - t)
+        if index in consumed:
+            answers.append(consumed[index] - t_us)
+        if answers:
+            latencies.append(min(answers))
+    return latencies
+
+
+def capture(events, duration_ms, resolution=4, reverse=False):
+    """
+    Record a trace by running a pin script past a bare EncoderDriver with a
+    TraceRecorder attached, the same way it is recorded on the board.
+    events use pins 6 (CLK), 7 (DT) and 8 (SW).
+    """
+    sim.install()
+    from core.trace import TraceRecorder
+    from devices.encoder_driver import EncoderDriver
+
+    encoder = EncoderDriver(6, 7, 8, resolution=resolution, reverse=reverse)
+    recorder = TraceRecorder(encoder, capacity=len(events) + 1)
+    recorder.start()
+    sim.run(asyncio.sleep(duration_ms / 1000), duration_ms, events)
+    trace = recorder.stop()
+    sim.uninstall()
+    return trace
+
+
+def synthetic_corpus():
+    """{name: (events, duration_ms)} covering the cases that have bitten before"""
+    corpus = {}
+    corpus['slow_turn'] = (sim.quadrature(6, 7, 80, 40, start_us=50_000), 2_200)
+    corpus['fast_spin'] = (sim.quadrature(6, 7, 4000, 5000, start_us=50_000), 1_000)
+    corpus['fast_spin_back'] = (sim.quadrature(6, 7, 4000, 5000, start_us=50_000, direction=-1), 1_000)
+    reversal = sim.quadrature(6, 7, 400, 2000, start_us=50_000)
+    reversal += sim.quadrature(6, 7, 200, 2000, start_us=300_000, direction=-1)
+    corpus['reversal'] = (reversal, 500)
+    clicks = []
+    for n in range(5):
+        clicks += sim.press(8, 100_000 + n * 250_000, 60_000, bounce=6, bounce_us=300)
+    corpus['bouncy_clicks'] = (clicks, 1_500)
+    corpus['long_press'] = (sim.press(8, 100_000, 1_500_000, bounce=8), 2_000)
+    return corpus
+
+
+def replay(trace, target='main', speed=1.0, verbose=False, handler_us=HANDLER_US):
+    """
+    Run `target`'s entry point against the trace; returns a report dict.
+    Every event loop callback is charged handler_us of simulated time.
+    """
+    clk, dt, sw, outputs, entry = TARGETS[target]
+    sim.install(handler_us=handler_us)
+    # Put the lines where the trace starts before the firmware reads them
+    for bit, pin_id in ((4, clk), (2, dt), (1, sw)):
+        sim.drive(pin_id, 1 if trace.initial & bit else 0)
+    sys.modules.pop(target, None)
+    out = io.StringIO()
+    with contextlib.nullcontext() if verbose else contextlib.redirect_stdout(out):
+        module = importlib.import_module(target)
+        start_us = 100_000  # Leave time for start-up
+        events = trace_events(trace, clk, dt, sw, speed, start_us)
+        accepted = []
+        consumed = {}
+        origin_us = sim.now_us()
+        duration_ms = (start_us + int(trace.duration_us() / speed)) // 1000 + 500
+
+        async def firmware():
+            script_tracked(events, clk, accepted, consumed)
+            await getattr(module, entry)()
+
+        sim.run(firmware(), duration_ms)
+
+    encoder = sim.irq_owner(clk)
+    latencies = answer_latencies(accepted, consumed, outputs, origin_us, handler_us)
+    report = {
+        'edges': len(events),
+        'accepted': len(accepted),
+        'expected': trace.expected(encoder.decoder.resolution, encoder.decoder.reverse),
+        'decoded': encoder.counter,
+        'rejected': encoder.decoder.invalid,
+        'ring_overflow': encoder.edges_dropped,
+        'irqs': encoder.irq_count,
+        'p50_us': sim.percentile(latencies, 50),
+        'p99_us': sim.percentile(latencies, 99),
+        'max_us': max(latencies) if latencies else None,
+    }
+    sim.uninstall()
+    return report
+
+
+def _fmt(value):
+    return '-' if value is None else str(value)
+
+
+def cli(argv=None):
+    from core import trace as trace_format
+
+    parser = argparse.ArgumentParser(prog='python -m sim.replay', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('traces', nargs='*')
+    parser.add_argument('--target', choices=sorted(TARGETS), default='main')
+    parser.add_argument('--speed', type=float, default=1.0, help='playback speed factor')
+    parser.add_argument('--check', action='store_true', help='fail on count mismatches or slow p99')
+    parser.add_argument('--max-p99-us', type=int, default=MAX_P99_US)
+    parser.add_argument('--handler-us', type=int, default=HANDLER_US,
+                        help='simulated time each IRQ handler or task step takes')
+    parser.add_argument('--make-corpus', metavar='DIR', help='write the synthetic traces to DIR')
+    parser.add_argument('--verbose', action='store_true', help="show the firmware's own prints")
+    args = parser.parse_args(argv)
+
+    if args.make_corpus:
+        for name, (events, duration_ms) in synthetic_corpus().items():
+            path = '%s/%s.rtr' % (args.make_corpus.rstrip('/'), name)
+            capture(events, duration_ms).save(path)
+            print('wrote', path)
+
+    failed = 0
+    for path in args.traces:
+        report = replay(trace_format.load(path), args.target, args.speed, args.verbose, args.handler_us)
+        ok = report['decoded'] == report['expected'] and (
+            report['p99_us'] is None or report['p99_us'] <= args.max_p99_us)
+        failed += not ok
+        print('%-28s %s  count %d/%d  rejected %d  ring overflow %d  edge->PWM p50 %s p99 %s max %s us' % (
+            path, 'ok  ' if ok else 'FAIL', report['decoded'], report['expected'], report['rejected'],
+            report['ring_overflow'], _fmt(report['p50_us']), _fmt(report['p99_us']), _fmt(report['max_us'])))
+    if args.check and failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    cli()
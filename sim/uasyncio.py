@@ -0,0 +1,115 @@
+"""MicroPython-only asyncio primitives, rebuilt on top of CPython's asyncio"""
+
+import asyncio
+
+
+class ThreadSafeFlag:
+    """
+    Same contract as MicroPython's asyncio.ThreadSafeFlag: set() may be called
+    from an IRQ handler, wait() returns once it has been set and clears it.
+    """
+
+    def __init__(self):
+        self._flag = False
+        self._waiter = None
+
+    def set(self):
+        self._flag = True
+        waiter = self._waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    def clear(self):
+        self._flag = False
+
+    def is_set(self):
+        return self._flag
+
+    async def wait(self):
+        if not self._flag:
+            self._waiter = asyncio.get_running_loop().create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+        self._flag = False
+
+
+def sleep_ms(ms):
+    return asyncio.sleep(ms / 1000)
+
+
+def wait_for_ms(aw, timeout):
+    return asyncio.wait_for(aw, timeout / 1000)
+
+
+class Stream:
+    """
+    MicroPython's asyncio.StreamReader/StreamWriter (one class there) over
+    anything with fileno(), read(n) and write(buf): a simulated UART, a
+    pty or a pipe. Reads wait on the event loop for the descriptor.
+    """
+
+    def __init__(self, s, e={}):
+        self.s = s
+        self.e = e
+        self.out_buf = b''
+
+    def get_extra_info(self, v):
+        return self.e[v]
+
+    async def _readable(self):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        fd = self.s.fileno()
+        loop.add_reader(fd, future.set_result, None)
+        try:
+            await future
+        finally:
+            loop.remove_reader(fd)
+
+    async def read(self, n=-1):
+        await self._readable()
+        return self.s.read(n if n > 0 else 4096) or b''
+
+    async def readinto(self, buf):
+        await self._readable()
+        return self.s.readinto(buf)
+
+    async def readexactly(self, n):
+        data = b''
+        while len(data) < n:
+            chunk = await self.read(n - len(data))
+            if not chunk:
+                raise EOFError
+            data += chunk
+        return data
+
+    async def readline(self):
+        line = b''
+        while not line.endswith(b'\n'):
+            chunk = await self.read(1)
+            if not chunk:
+                break
+            line += chunk
+        return line
+
+    def write(self, buf):
+        self.out_buf += bytes(buf)
+
+    async def drain(self):
+        while self.out_buf:
+            written = self.s.write(self.out_buf)
+            self.out_buf = self.out_buf[written or 0:]
+            if self.out_buf:
+                await asyncio.sleep(0)
+
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        self.s.close()
+
+
+StreamReader = Stream
+StreamWriter = Stream